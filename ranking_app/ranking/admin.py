@@ -1,11 +1,16 @@
 from django.contrib import admin
+from django.contrib import messages
 from django.db import models
+from django.utils import timezone
 
 from .models import Content
 from .models import Category
+from .models import FetchFailure
+from .models import Ranking
 from .models import TwitterUser
-from .models import TwitterApi
 from .models import Staff
+from .models import SyncCursor
+from .utils import bump_ranking_generation
 
 # Register your models here.
 
@@ -33,9 +38,9 @@ class ContentAdmin(admin.ModelAdmin):
                            ('release_date', 'update_date')]}),
         ('カテゴリー', {'fields': ['category']}),
         ('最新ツイート', {'fields': ['latest_tweet_text', 'latest_tweet_date',
-                               'latest_tweet_create_date']})]
+                               'latest_tweet_create_date', 'last_sync_at']})]
     readonly_fields = ('update_date', 'latest_tweet_text', 'latest_tweet_date',
-                       'latest_tweet_create_date', 'appraise')
+                       'latest_tweet_create_date', 'last_sync_at', 'appraise')
     inlines = [StaffInline, TwitterUserInline]
 
     def get_tw_user_data(self, obj):
@@ -63,13 +68,51 @@ class ContentAdmin(admin.ModelAdmin):
             latest_tweet_count().create_date
         return create_datetime.strftime('%Y年%m月%d日%H:%M')
 
-    latest_tweet_create_date.short_description = '以前データ取得した日'
+    # 反応が変わった時だけTweetCountを作るので、最後に取得した日ではなく最後に反応が変わった日になる
+    latest_tweet_create_date.short_description = '最新ツイートの反応が変わった日'
+
+    def last_sync_at(self, obj):
+        last_sync_at = SyncCursor.objects.filter(
+            twitter_user__content=obj).values_list(
+            'last_sync_at', flat=True).first()
+        if not last_sync_at:
+            return '未取得'
+        return timezone.localtime(last_sync_at).strftime('%Y年%m月%d日%H:%M')
+
+    last_sync_at.short_description = '以前データ取得した日'
 
     def save_model(self, request, obj, form, change):
         super().save_model(request, obj, form, change)
         if not obj.has_tweets():
+            # TwitterAPIのクライアントは管理画面で保存するときだけ使うのでここでimportする
+            from .twitter import TwitterApi
+            from .twitter import TwitterApiError
             api = TwitterApi()
-            api.get_and_store_twitter_data(obj)
+            try:
+                api.get_and_store_twitter_data(obj)
+            except TwitterApiError as e:
+                FetchFailure.record(obj)
+                self.message_user(
+                    request, 'Twitterのデータを取得できませんでした。{}'.format(e),
+                    messages.WARNING)
+            else:
+                FetchFailure.clear(obj)
+        Ranking.refresh(obj.category)
+        bump_ranking_generation()
+
+    def delete_model(self, request, obj):
+        category = obj.category
+        super().delete_model(request, obj)
+        Ranking.refresh(category)
+        bump_ranking_generation()
+
+    def delete_queryset(self, request, queryset):
+        categories = {content.category
+                      for content in queryset.select_related('category')}
+        super().delete_queryset(request, queryset)
+        for category in categories:
+            Ranking.refresh(category)
+        bump_ranking_generation()
 
 
 @admin.register(Category)
@@ -86,3 +129,16 @@ class CategoryAdmin(admin.ModelAdmin):
             return '該当なし'
 
     get_contents.short_description = 'コンテンツ'
+
+    # カテゴリー名はキャッシュしたページにも表示されるので、変更したら世代番号を新しくする
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        bump_ranking_generation()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        bump_ranking_generation()
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        bump_ranking_generation()
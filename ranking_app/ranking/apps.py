@@ -1,5 +1,15 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
 
 
 class RankingConfig(AppConfig):
     name = 'ranking'
+
+    def ready(self):
+        from .models import Category
+        from .registry import category_registry
+        post_save.connect(category_registry.invalidate, sender=Category,
+                          dispatch_uid='category_registry_save')
+        post_delete.connect(category_registry.invalidate, sender=Category,
+                            dispatch_uid='category_registry_delete')
@@ -0,0 +1,93 @@
+from datetime import timedelta
+from itertools import groupby
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Tweet
+from .models import TweetCount
+
+# この日数より新しいTweetCountはすべて残す
+COMPACTION_FULL_DAYS = 7
+# この日数より新しいTweetCountは1日に1つ、それより古いものは1週間に1つ残す
+COMPACTION_DAILY_DAYS = 90
+# 1つのトランザクションで処理するツイート数
+COMPACTION_CHUNK_SIZE = 500
+
+
+def snapshots_to_delete(snapshots, now, full_days=COMPACTION_FULL_DAYS,
+                        daily_days=COMPACTION_DAILY_DAYS):
+    """
+    1つのツイートのTweetCountのうち、間引いて削除するもののidを返す。
+    最新のTweetCountは必ず残し、値が変わっていない連続したTweetCountは最初の1つだけ残す。
+    :param snapshots: list 古い順に並んだ(id, create_date, retweet_count, favorite_count)
+    :param now: datetime
+    :param full_days: int すべて残す日数
+    :param daily_days: int 1日に1つ残す日数
+    :return list: 削除するTweetCountのid
+    """
+    if not snapshots:
+        return []
+    full_start = now - timedelta(days=full_days)
+    daily_start = now - timedelta(days=daily_days)
+    latest_pk = snapshots[-1][0]
+    kept = {latest_pk}
+    buckets = {}
+    for pk, create_date, _, _ in snapshots[:-1]:
+        if create_date >= full_start:
+            kept.add(pk)
+            continue
+        local_date = timezone.localtime(create_date).date()
+        if create_date >= daily_start:
+            bucket = local_date
+        else:
+            bucket = local_date.isocalendar()[:2]
+        # 古い順に見ているので、期間ごとに一番新しいものが残る
+        buckets[bucket] = pk
+    kept.update(buckets.values())
+    deleted, previous_counts = [], None
+    for pk, _, retweet_count, favorite_count in snapshots:
+        counts = (retweet_count, favorite_count)
+        if pk not in kept or (counts == previous_counts and pk != latest_pk):
+            deleted.append(pk)
+        else:
+            previous_counts = counts
+    return deleted
+
+
+@transaction.atomic
+def compact_tweet_counts(tweet_pks, now=None, full_days=COMPACTION_FULL_DAYS,
+                         daily_days=COMPACTION_DAILY_DAYS, dry_run=False):
+    """
+    tweet_pksのツイートのTweetCountを間引く。１回のトランザクションで処理するので、
+    ロックを長く持たないようにtweet_pksは少しずつ渡す。
+    :return int: 削除した(dry_runなら削除する)TweetCountの数
+    """
+    now = now or timezone.now()
+    rows = TweetCount.objects.filter(tweet_id__in=tweet_pks).order_by(
+        'tweet_id', 'create_date', 'pk').values_list(
+        'tweet_id', 'pk', 'create_date', 'retweet_count', 'favorite_count')
+    deleted = []
+    for _, snapshots in groupby(rows, key=lambda row: row[0]):
+        deleted.extend(snapshots_to_delete(
+            [snapshot[1:] for snapshot in snapshots], now, full_days,
+            daily_days))
+    if not dry_run:
+        for start in range(0, len(deleted), COMPACTION_CHUNK_SIZE):
+            TweetCount.objects.filter(
+                pk__in=deleted[start:start + COMPACTION_CHUNK_SIZE]).delete()
+    return len(deleted)
+
+
+def iter_tweet_chunks(chunk_size=COMPACTION_CHUNK_SIZE):
+    """
+    ツイートのpkをchunk_size件ずつ返す。OFFSETを使わずにpkの範囲で進める
+    """
+    last_pk = 0
+    while True:
+        tweet_pks = list(Tweet.objects.filter(pk__gt=last_pk).order_by(
+            'pk').values_list('pk', flat=True)[:chunk_size])
+        if not tweet_pks:
+            return
+        yield tweet_pks
+        last_pk = tweet_pks[-1]
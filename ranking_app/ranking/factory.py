@@ -13,6 +13,7 @@ START_TIME = datetime(2000, 1, 1, tzinfo=JA_TZ)
 class CategoryFactory(factory.django.DjangoModelFactory):
     class Meta:
         model = models.Category
+        django_get_or_create = ('name',)
 
     name = factory.Iterator(['アニメ', 'ドラマ'])
 
@@ -0,0 +1,64 @@
+from datetime import datetime
+import io
+from pytz import timezone
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import matplotlib.dates as mdates
+from matplotlib.figure import Figure
+
+from .utils import quarter_start_datetime
+
+
+class Graph(object):
+    """
+    ポイント推移のグラフを描画する。pyplotのグローバルな状態は使わず、描画ごとにFigureを作るので
+    複数のスレッドから同時に使える。使い終わったらplt_cleanかwith文でFigureを解放する。
+    """
+
+    def __init__(self):
+        self.figure = Figure()
+        FigureCanvasAgg(self.figure)
+        self.ax = None
+        self.svg = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.plt_clean()
+
+    def set_rank_graph(self, content):
+        start = quarter_start_datetime()
+        series = content.twitteruser.tweet_series(start)
+        self.plot(series.dates, series.points(), start)
+
+    def plot(self, dates, points, start):
+        """
+        :param dates: list ツイート日
+        :param points: list ツイートごとのポイント
+        :param start: datetime グラフの開始日
+        """
+        ja_tz = timezone('Asia/Tokyo')
+        self.ax = self.figure.add_subplot()
+        self.ax.plot(dates, points)
+        date_format = mdates.DateFormatter("%m/%d")
+        date_interval = mdates.DayLocator(interval=5, tz=ja_tz)
+        self.ax.xaxis.set_major_locator(date_interval)
+        self.ax.xaxis.set_major_formatter(date_format)
+        self.ax.set_xlim(start, datetime.now(ja_tz))
+
+    def plt_to_svg(self):
+        buf = io.BytesIO()
+        self.figure.savefig(buf, format='svg', bbox_inches='tight')
+        self.svg = buf.getvalue()
+        buf.close()
+        return self.svg
+
+    def plt_clean(self):
+        """
+        Figureが持っている描画データを解放する
+        """
+        if self.figure is not None:
+            self.figure.clear()
+            self.figure = None
+            self.ax = None
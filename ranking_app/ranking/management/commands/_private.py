@@ -0,0 +1,5 @@
+def print_fetch_error(content, error):
+    """
+    Twitterデータを取得できなかったcontentを表示する
+    """
+    print('{} : データを取得できませんでした。{}'.format(content.name, error))
@@ -1,7 +1,12 @@
 from django.core.management.base import BaseCommand
 
+from ._private import print_fetch_error
 from ...models import Content
-from ...models import TwitterApi
+from ...models import FetchFailure
+from ...models import Ranking
+from ...twitter import TwitterApi
+from ...twitter import TwitterApiError
+from ...utils import bump_ranking_generation
 
 
 class Command(BaseCommand):
@@ -16,8 +21,16 @@ class Command(BaseCommand):
         screen_name = options['sn'].pop()
         api = TwitterApi()
         content = Content.objects.get(screen_name=screen_name)
-        if content.has_tweets():
-            api.update_data(content)
-        else:
-            api.get_and_store_twitter_data(content)
+        try:
+            if content.has_tweets():
+                api.update_data(content)
+            else:
+                api.get_and_store_twitter_data(content)
+        except TwitterApiError as e:
+            FetchFailure.record(content)
+            print_fetch_error(content, e)
+            return
+        FetchFailure.clear(content)
+        Ranking.refresh(content.category)
+        bump_ranking_generation()
         print('データ取得完了しました！！')
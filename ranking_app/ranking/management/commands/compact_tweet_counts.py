@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ...compaction import COMPACTION_CHUNK_SIZE
+from ...compaction import COMPACTION_DAILY_DAYS
+from ...compaction import COMPACTION_FULL_DAYS
+from ...compaction import compact_tweet_counts
+from ...compaction import iter_tweet_chunks
+
+
+class Command(BaseCommand):
+
+    help = 'Downsample old TweetCount snapshots.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full-days', type=int,
+                            default=COMPACTION_FULL_DAYS,
+                            help='すべてのTweetCountを残す日数')
+        parser.add_argument('--daily-days', type=int,
+                            default=COMPACTION_DAILY_DAYS,
+                            help='1日に1つTweetCountを残す日数。それより古いものは1週間に1つ残します。')
+        parser.add_argument('--chunk-size', type=int,
+                            default=COMPACTION_CHUNK_SIZE,
+                            help='1つのトランザクションで処理するツイート数')
+        parser.add_argument('--pause', type=float, default=0,
+                            help='トランザクションの間に待つ秒数')
+        parser.add_argument('--dry-run', action='store_true', default=False,
+                            help='削除せずに削除する数だけ表示します。')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        total = 0
+        for tweet_pks in iter_tweet_chunks(options['chunk_size']):
+            total += compact_tweet_counts(
+                tweet_pks, now, options['full_days'], options['daily_days'],
+                dry_run=options['dry_run'])
+            if options['pause']:
+                time.sleep(options['pause'])
+        if options['dry_run']:
+            print('{}個のTweetCountを削除できます。'.format(total))
+        else:
+            print('{}個のTweetCountを削除しました。'.format(total))
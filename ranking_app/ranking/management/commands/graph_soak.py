@@ -0,0 +1,71 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import random
+import resource
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...graph import Graph
+from ...sparkline import sparkline_svg
+from ...utils import quarter_start_datetime
+
+
+def current_rss_kb():
+    """
+    現在のメモリ使用量(RSS)をKBで返す。/procがなければ最大RSSを返す。
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() // 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def render_sample_graph(points_count, backend='matplotlib'):
+    start = quarter_start_datetime()
+    dates = [start + timedelta(hours=num * 6) for num in range(points_count)]
+    points = [random.uniform(0, 10) for _ in range(points_count)]
+    if backend == 'sparkline':
+        return len(sparkline_svg(dates, points, start, dates[-1]))
+    with Graph() as graph:
+        graph.plot(dates, points, start)
+        return len(graph.plt_to_svg())
+
+
+class Command(BaseCommand):
+
+    help = 'Render many rank graphs and report memory usage (soak test).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=500,
+                            help='描画するグラフの数')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='同時に描画するスレッド数')
+        parser.add_argument('--points', type=int, default=300,
+                            help='グラフ１つあたりの点の数')
+        parser.add_argument('--backend', default='matplotlib',
+                            choices=['matplotlib', 'sparkline'],
+                            help='グラフの描画方法')
+
+    def handle(self, *args, **options):
+        count = options['count']
+        report_interval = max(count // 10, 1)
+        start_rss = current_rss_kb()
+        start_time = time.monotonic()
+        print('開始時のRSS: {:,} KB'.format(start_rss))
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            results = executor.map(render_sample_graph,
+                                   [options['points']] * count,
+                                   [options['backend']] * count)
+            for num, _ in enumerate(results, 1):
+                if num % report_interval == 0:
+                    print('{:>6}個描画 RSS: {:,} KB'.format(
+                        num, current_rss_kb()))
+        elapsed = time.monotonic() - start_time
+        end_rss = current_rss_kb()
+        print('{}個のグラフを{:.1f}秒で描画しました。({:.1f}ms/個)'.format(
+            count, elapsed, elapsed * 1000 / count))
+        print('終了時のRSS: {:,} KB (増加量: {:,} KB)'.format(
+            end_rss, end_rss - start_rss))
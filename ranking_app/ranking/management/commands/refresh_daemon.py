@@ -0,0 +1,80 @@
+import time
+import traceback
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from ._private import print_fetch_error
+from ...models import Content
+from ...models import Ranking
+from ...scheduler import RefreshScheduler
+from ...twitter import FETCH_WORKERS
+from ...twitter import TwitterFetcher
+from ...utils import bump_ranking_generation
+
+
+class Command(BaseCommand):
+
+    help = 'Keep refreshing the accounts most likely to have changed, ' \
+           'within an API call budget per cycle.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--budget', type=int, default=180,
+                            help='1回の更新で使うAPIの呼び出し回数の上限')
+        parser.add_argument('--interval', type=int, default=15 * 60,
+                            help='更新の間隔(秒)')
+        parser.add_argument('--workers', type=int, default=FETCH_WORKERS,
+                            help='並行してデータを取得するアカウント数')
+        parser.add_argument('--once', action='store_true', default=False,
+                            help='1回だけ更新して終了します。')
+
+    def handle(self, *args, **options):
+        # レート制限の残り回数を次の更新でも使うので、TwitterFetcherは使い回す
+        fetcher = TwitterFetcher(workers=options['workers'])
+        try:
+            while True:
+                started = time.monotonic()
+                self.refresh_safely(fetcher, options['budget'])
+                if options['once']:
+                    break
+                time.sleep(max(
+                    options['interval'] - (time.monotonic() - started), 0))
+        except KeyboardInterrupt:
+            print('更新を終了します。')
+
+    @classmethod
+    def refresh_safely(cls, fetcher, budget):
+        """
+        refreshで起きた例外を表示して、次の更新を続けられるようにする。
+        長く動き続けるので、更新の前後で切れたDB接続を閉じる。
+        :return list: 更新したcontentのlist。失敗した時は空のlist
+        """
+        close_old_connections()
+        try:
+            return cls.refresh(fetcher, budget)
+        except Exception:
+            print('更新に失敗しました。次の更新で再試行します。')
+            traceback.print_exc()
+            return []
+        finally:
+            close_old_connections()
+
+    @staticmethod
+    def refresh(fetcher, budget):
+        """
+        スコアの高いアカウントからbudget以内で更新して、ランキングを集計し直す
+        :return list: 更新したcontentのlist
+        """
+        contents = Content.objects.select_related(
+            'category', 'twitteruser__synccursor', 'fetchfailure')
+        picked = RefreshScheduler().pick(contents, budget)
+        updated = list(fetcher.update_contents(
+            [candidate.content for candidate in picked],
+            on_error=print_fetch_error))
+        for category in {content.category for content in updated}:
+            Ranking.refresh(category)
+        if updated:
+            bump_ranking_generation()
+        print('{}個のアカウントを更新しました。(APIの呼び出し予定: {}回)'.format(
+            len(updated), sum(candidate.cost for candidate in picked)))
+        return updated
@@ -1,7 +1,15 @@
+from django.conf import settings
 from django.core.management.base import BaseCommand
 
-from ...models import ScrapingContent
-from ...models import TwitterApi
+from ._private import print_fetch_error
+from ...models import Category
+from ...models import FetchFailure
+from ...models import Ranking
+from ...scraping import ResponseCache
+from ...scraping import ScrapingContent
+from ...twitter import TwitterApi
+from ...twitter import TwitterApiError
+from ...utils import bump_ranking_generation
 
 
 class Command(BaseCommand):
@@ -14,30 +22,58 @@ class Command(BaseCommand):
                             help='アニメ情報を取得します。')
         parser.add_argument('--drama', action='store_true', default=False,
                             help='ドラマ情報を取得します。')
+        parser.add_argument('--no-cache', action='store_true', default=False,
+                            help='取得したページのキャッシュを使いません。')
+        parser.add_argument('--offline', action='store_true', default=False,
+                            help='リクエストせずにキャッシュしたページだけを使います。')
+
+    @staticmethod
+    def scraping_content(options):
+        cache = None
+        if not options['no_cache']:
+            cache = ResponseCache(settings.SCRAPING_CACHE_DIR)
+        return ScrapingContent(cache=cache, offline=options['offline'])
+
+    @staticmethod
+    def store_twitter_data(contents):
+        """
+        contentsのTwitterデータを取得する。取得できなかったアカウントは記録して次に進む
+        """
+        api = TwitterApi()
+        for content in contents:
+            try:
+                api.get_and_store_twitter_data(content)
+            except TwitterApiError as e:
+                print_fetch_error(content, e)
+                FetchFailure.record(content)
+                continue
+            FetchFailure.clear(content)
 
     def handle(self, *args, **options):
         # TODO 取得データをファイルに一時保存んするか考える。スクレイピング結果の確認方法について。
         if options['anime']:
-            content_getter = ScrapingContent().get_anime_data()
+            content_getter = self.scraping_content(options).get_anime_data()
             print('アニメサイトのスクレイピングが完了しました。')
-            api = TwitterApi()
+            print(content_getter.report())
             try:
-                for content in content_getter.contents:
-                    api.get_and_store_twitter_data(content)
+                self.store_twitter_data(content_getter.contents)
                 print('Twitterの情報取得完了しました。')
                 print('合計{}個のモデルを作成しました。'.format(len(content_getter.contents)))
+                Ranking.refresh(Category.objects.get(name='アニメ'))
+                bump_ranking_generation()
             except AttributeError as e:
                 print('スクレイピングが失敗しました。保存したモデルはロールバックされます。コードを見直してください。:'
                       '{}'.format(e))
         if options['drama']:
-            content_getter = ScrapingContent().get_drama_data()
+            content_getter = self.scraping_content(options).get_drama_data()
             print('ドラマサイトのスクレイピングが完了しました。')
-            api = TwitterApi()
+            print(content_getter.report())
             try:
-                for content in content_getter.contents:
-                    api.get_and_store_twitter_data(content)
+                self.store_twitter_data(content_getter.contents)
                 print('Twitterの情報取得完了しました。')
                 print('合計{}個のモデルを作成しました。'.format(len(content_getter.contents)))
+                Ranking.refresh(Category.objects.get(name='ドラマ'))
+                bump_ranking_generation()
             except AttributeError as e:
                 print('スクレイピングが失敗しました。保存したモデルはロールバックされます。コードを見直してください。: '
                       '{}'.format(e))
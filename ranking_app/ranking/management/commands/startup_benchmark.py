@@ -0,0 +1,109 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+# Webのプロセスが起動時に読み込んではいけない重いライブラリ
+HEAVY_MODULES = ['matplotlib', 'bs4', 'requests_oauthlib']
+
+# 新しいプロセスでDjangoを起動して最初のリクエストを返すまでを計る
+STARTUP_SCRIPT = '''
+import json
+import sys
+import time
+start = time.perf_counter()
+import django
+django.setup()
+from django.conf import settings
+from django.test import Client
+setup_time = time.perf_counter() - start
+# 計測用のリクエストなので、設定に関係なくホスト名を許可する
+settings.ALLOWED_HOSTS = [sys.argv[2]]
+response = Client(HTTP_HOST=sys.argv[2]).get(sys.argv[1])
+first_request_time = time.perf_counter() - start
+print(json.dumps({
+    'setup': setup_time,
+    'first_request': first_request_time,
+    'status_code': response.status_code,
+    'modules': sorted(sys.modules),
+}))
+'''
+
+
+def run_startup(path, host, importtime=False):
+    """
+    新しいPythonプロセスでSTARTUP_SCRIPTを実行する
+    :return tuple: (計測結果のdict, -X importtimeの出力)
+    """
+    command = [sys.executable]
+    if importtime:
+        command += ['-X', 'importtime']
+    command += ['-c', STARTUP_SCRIPT, path, host]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    result = subprocess.run(command, cwd=settings.BASE_DIR, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    if result.returncode != 0:
+        raise CommandError('計測用のプロセスが失敗しました\n' + result.stderr)
+    return json.loads(result.stdout.splitlines()[-1]), result.stderr
+
+
+def parse_importtime(output):
+    """
+    -X importtimeの出力からトップレベルのモジュールごとの累積時間(マイクロ秒)を読み取る
+    """
+    top_level = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not cumulative.strip().isdigit() or name.startswith('  '):
+            continue
+        top_level[name.strip()] = int(cumulative)
+    return top_level
+
+
+class Command(BaseCommand):
+
+    help = 'Measure import time and time to first request of a new process.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/',
+                            help='最初のリクエストのパス')
+        parser.add_argument('--host', default='localhost',
+                            help='リクエストのHostヘッダー')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='計測する回数(一番速い結果を使う)')
+        parser.add_argument('--top', type=int, default=10,
+                            help='表示する重いモジュールの数')
+        parser.add_argument('--max-first-request', type=float, default=None,
+                            help='最初のリクエストまでの時間(秒)の上限')
+
+    def handle(self, *args, **options):
+        results = [run_startup(options['path'], options['host'])[0]
+                   for _ in range(options['repeat'])]
+        best = min(results, key=lambda result: result['first_request'])
+        _, importtime = run_startup(options['path'], options['host'],
+                                    importtime=True)
+
+        print('django.setup()まで: {:.0f}ms'.format(best['setup'] * 1000))
+        print('最初のリクエストまで: {:.0f}ms (status {})'.format(
+            best['first_request'] * 1000, best['status_code']))
+        print('import時間の長いモジュール:')
+        top_level = sorted(parse_importtime(importtime).items(),
+                           key=lambda item: -item[1])
+        for name, cumulative in top_level[:options['top']]:
+            print('{:>8.1f}ms  {}'.format(cumulative / 1000, name))
+
+        loaded = [name for name in HEAVY_MODULES if name in best['modules']]
+        if loaded:
+            raise CommandError('起動時に重いモジュールが読み込まれています: {}'.format(
+                ', '.join(loaded)))
+        max_first_request = options['max_first_request']
+        if max_first_request and best['first_request'] > max_first_request:
+            raise CommandError('最初のリクエストまで{:.2f}秒かかりました(上限{}秒)'.format(
+                best['first_request'], max_first_request))
@@ -1,7 +1,12 @@
 from django.core.management.base import BaseCommand
 
+from ._private import print_fetch_error
 from ...models import Category
-from ...models import TwitterApi
+from ...models import Ranking
+from ...scheduler import RefreshScheduler
+from ...twitter import FETCH_WORKERS
+from ...twitter import TwitterFetcher
+from ...utils import bump_ranking_generation
 
 
 class Command(BaseCommand):
@@ -13,18 +18,33 @@ class Command(BaseCommand):
                             help='アニメ情報を取得します。')
         parser.add_argument('--drama', action='store_true', default=False,
                             help='ドラマ情報を取得します。')
+        parser.add_argument('--workers', type=int, default=FETCH_WORKERS,
+                            help='並行してデータを取得するアカウント数')
+        parser.add_argument('--budget', type=int, default=None,
+                            help='APIの呼び出し回数の上限。指定すると変化の大きそうなアカウントから更新します。')
 
     def handle(self, *args, **options):
-        contents = None
-        api = TwitterApi()
+        category, contents = None, None
         if options['anime']:
-            contents = Category.objects.get(name='アニメ').content_set.all()
+            category = Category.objects.get(name='アニメ')
         elif options['drama']:
-            contents = Category.objects.get(name='ドラマ').content_set.all()
+            category = Category.objects.get(name='ドラマ')
+        if category:
+            contents = category.content_set.select_related(
+                'twitteruser__synccursor', 'fetchfailure')
         if contents:
-            for content in contents:
-                if content.has_tweets():
-                    api.update_data(content)
-                    print('{} : データ取得完了しました！！'.format(content.name))
+            fetcher = TwitterFetcher(workers=options['workers'])
+            targets = [content for content in contents if content.has_tweets()]
+            if options['budget'] is not None:
+                picked = RefreshScheduler().pick(targets, options['budget'])
+                targets = [candidate.content for candidate in picked]
+                print('{}個のアカウントを更新します。(APIの呼び出し予定: {}回)'.format(
+                    len(picked), sum(candidate.cost for candidate in picked)))
+            for content in fetcher.update_contents(
+                    targets, on_error=print_fetch_error):
+                print('{} : データ取得完了しました！！'.format(content.name))
+            Ranking.refresh(category)
+            bump_ranking_generation()
+            print('ランキングを更新しました。')
         else:
             print('オプションを付けてないか、contentが存在しない')
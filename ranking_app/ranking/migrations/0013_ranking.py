@@ -0,0 +1,29 @@
+# Generated by Django 3.0.5 on 2026-10-18 06:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ranking', '0012_auto_20200428_0109'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Ranking',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveIntegerField(verbose_name='順位')),
+                ('points', models.FloatField(default=0, verbose_name='ポイント')),
+                ('create_date', models.DateTimeField(auto_now_add=True, verbose_name='集計日')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ranking.Category', verbose_name='ジャンル')),
+                ('content', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='ranking.Content', verbose_name='作品')),
+            ],
+            options={
+                'ordering': ['category', 'rank'],
+                'unique_together': {('category', 'rank')},
+            },
+        ),
+    ]
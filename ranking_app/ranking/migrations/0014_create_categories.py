@@ -0,0 +1,20 @@
+from django.db import migrations
+
+CATEGORY_NAMES = ['アニメ', 'ドラマ']
+
+
+def create_categories(apps, schema_editor):
+    Category = apps.get_model('ranking', 'Category')
+    for name in CATEGORY_NAMES:
+        Category.objects.get_or_create(name=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ranking', '0013_ranking'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_categories, migrations.RunPython.noop),
+    ]
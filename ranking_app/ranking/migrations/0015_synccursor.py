@@ -0,0 +1,23 @@
+# Generated by Django 3.0.5 on 2026-10-18 07:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ranking', '0014_create_categories'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncCursor',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('newest_id', models.BigIntegerField(blank=True, null=True, verbose_name='取得済みの最新ツイートID')),
+                ('last_sync_at', models.DateTimeField(blank=True, null=True, verbose_name='最終取得日')),
+                ('twitter_user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='ranking.TwitterUser', verbose_name='Twitterデータ')),
+            ],
+        ),
+    ]
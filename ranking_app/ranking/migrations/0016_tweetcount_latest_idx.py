@@ -0,0 +1,17 @@
+# Generated by Django 3.0.5 on 2026-10-18 07:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ranking', '0015_synccursor'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='tweetcount',
+            index=models.Index(fields=['tweet', '-create_date'], name='tweetcount_latest_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.0.5 on 2026-10-18 07:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ranking', '0016_tweetcount_latest_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FetchFailure',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('failure_count', models.PositiveIntegerField(default=0, verbose_name='失敗回数')),
+                ('last_failed_at', models.DateTimeField(verbose_name='最終失敗日')),
+                ('content', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='ranking.Content', verbose_name='作品')),
+            ],
+        ),
+    ]
@@ -1,23 +1,29 @@
-from collections import Counter
-from datetime import datetime
-import json
-import re
-import time
-from pytz import timezone
-import io
-
-from bs4 import BeautifulSoup
 from django.db import models
 from django.db import transaction
-import environ
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-from requests_oauthlib import OAuth1Session
-import urllib3
+from django.db.models import Case
+from django.db.models import Count
+from django.db.models import ExpressionWrapper
+from django.db.models import F
+from django.db.models import FloatField
+from django.db.models import OuterRef
+from django.db.models import Prefetch
+from django.db.models import Q
+from django.db.models import Subquery
+from django.db.models import Sum
+from django.db.models import Value
+from django.db.models import When
+from django.db.models.functions import Cast
+from django.db.models.functions import Coalesce
+from django.db.models.functions import Round
+from django.utils import timezone
+
+from .utils import quarter_start_datetime
 
 # Create your models here.
 
 HIGH_RANK_CONTENT = 5
+# 一覧ページに表示するキャストの人数
+MAIN_PERFORMERS = 4
 
 
 class Category(models.Model):
@@ -25,12 +31,51 @@ class Category(models.Model):
                             db_index=True)
 
     def has_high_rank_content_sort_by_twitter_data(self):
-        return Content.sort_twitter_rating_by(self)[:HIGH_RANK_CONTENT]
+        return self.ranking_set.select_related('content')[:HIGH_RANK_CONTENT]
 
     def __str__(self):
         return self.name
 
 
+def _round2(expression):
+    """
+    round(x, 2)と同じ丸めをDB側で行う式を返す
+    """
+    return ExpressionWrapper(Round(expression * 100) / 100,
+                             output_field=FloatField())
+
+
+def _average(count_field, zero_condition):
+    """
+    TwitterUserのretweets_avg、favorite_avgと同じ平均値を計算する式を返す
+    """
+    return Case(
+        When(zero_condition, then=Value(0.0)),
+        When(twitteruser__all_tweet_count=0, then=Value(0.0)),
+        default=_round2(Cast(F(count_field), FloatField()) /
+                        F('twitteruser__all_tweet_count')),
+        output_field=FloatField())
+
+
+class ContentQuerySet(models.QuerySet):
+
+    def with_points(self):
+        """
+        Content.appraiseと同じ計算式のポイントをDB側で計算し、pointsとしてannotateする。
+        並び替えや件数の制限、ページングもSQLで行えるようになる。
+        """
+        retweet_avg = _average('twitteruser__all_retweet_count',
+                               Q(twitteruser__all_retweet_count=0))
+        favorite_avg = _average('twitteruser__all_favorite_count',
+                                Q(twitteruser__all_favorite_count=0) |
+                                Q(twitteruser__all_retweet_count=0))
+        points = _round2((favorite_avg + retweet_avg * 2) / 100)
+        return self.annotate(points=Coalesce(points, Value(0.0)))
+
+    def order_by_points(self):
+        return self.with_points().order_by('-points', 'pk')
+
+
 class Content(models.Model):
     name = models.CharField('作品名', max_length=50, unique=True, db_index=True)
     description = models.TextField('詳細説明', null=True, blank=True)
@@ -47,6 +92,8 @@ class Content(models.Model):
     img_url = models.CharField('画像のURL', max_length=500, null=True,
                                blank=True)
 
+    objects = ContentQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
@@ -76,31 +123,32 @@ class Content(models.Model):
         カテゴリーに含まれるツイッター評価値順にソートしたコンテンツを返す
         :return list: [{'rank': int(順位), 'content': cls(content), 'points': int(ポイント)}, ..]
         """
+        contents = cls.objects.order_by_points()
         if category:
-            contents = {
-                content: content.appraise()
-                for content in cls.objects.filter(category=category)}
-        else:
-            contents = {
-                content: content.appraise()
-                for content in cls.objects.all()}
-        score_sorted = sorted(contents.items(), key=lambda x: x[1],
-                              reverse=True)
-        ranking, sort_result = 1, []
-        for content_tuple in score_sorted:
-            content_data = {'rank': ranking, 'content': content_tuple[0],
-                            'points': content_tuple[1]}
-            sort_result.append(content_data)
-            ranking += 1
-        return sort_result
+            contents = contents.filter(category=category)
+        return [{'rank': ranking, 'content': content, 'points': content.points}
+                for ranking, content in enumerate(contents, 1)]
 
     def rank(self):
-        sort_contents = Content.sort_twitter_rating_by(self.category)
-        rank_list = [info['content'] for info in sort_contents]
-        return rank_list.index(self) + 1
+        """
+        Rankingモデルに保存された集計結果から順位を返す。
+        まだ集計されていなければ、自分よりポイントの高いコンテンツの数をCOUNTして順位とする。
+        どちらもカテゴリーの作品数に関係なく一定のクエリ数で済む。
+        """
+        try:
+            return self.ranking.rank
+        except Ranking.DoesNotExist:
+            higher_contents = Content.objects.with_points().filter(
+                category_id=self.category_id, points__gt=self.appraise())
+            return higher_contents.count() + 1
 
     def main_performers(self):
-        return self.staff_set.filter(is_cast=True)[:4]
+        """
+        RankingQuerySet.with_contentsでキャストを読み込み済みなら、クエリを使わずにその中から返す
+        """
+        if hasattr(self, 'cast_list'):
+            return self.cast_list[:MAIN_PERFORMERS]
+        return self.staff_set.filter(is_cast=True)[:MAIN_PERFORMERS]
 
     def performers(self):
         return self.staff_set.filter(is_cast=True)
@@ -109,6 +157,55 @@ class Content(models.Model):
         return self.staff_set.filter(is_cast=False)
 
 
+class RankingQuerySet(models.QuerySet):
+
+    def with_contents(self):
+        """
+        一覧ページで使うコンテンツ、TwitterUser、キャストをまとめて読み込む。
+        キャストはContentのcast_listに入る。
+        """
+        cast = Staff.objects.filter(is_cast=True).order_by('pk')
+        return self.select_related('content__twitteruser').prefetch_related(
+            Prefetch('content__staff_set', queryset=cast,
+                     to_attr='cast_list'))
+
+
+class Ranking(models.Model):
+    """
+    カテゴリーごとのランキングの集計結果。データ取得時にrefreshメソッドで作り直す。
+    """
+    category = models.ForeignKey(Category, on_delete=models.CASCADE,
+                                 verbose_name='ジャンル')
+    content = models.OneToOneField(Content, on_delete=models.CASCADE,
+                                   verbose_name='作品')
+    rank = models.PositiveIntegerField('順位')
+    points = models.FloatField('ポイント', default=0)
+    create_date = models.DateTimeField('集計日', auto_now_add=True)
+
+    objects = RankingQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['category', 'rank']
+        unique_together = ('category', 'rank')
+
+    def __str__(self):
+        return '{}位 {}'.format(self.rank, self.content)
+
+    @classmethod
+    @transaction.atomic
+    def refresh(cls, category):
+        """
+        カテゴリーのランキングを集計し直して保存する
+        :param category: obj
+        """
+        sort_result = Content.sort_twitter_rating_by(category)
+        cls.objects.filter(
+            Q(category=category) | Q(content__category=category)).delete()
+        cls.objects.bulk_create([
+            cls(category=category, content=info['content'], rank=info['rank'],
+                points=info['points']) for info in sort_result])
+
+
 class Staff(models.Model):
     name = models.CharField(max_length=50, db_index=True)
     role = models.CharField(max_length=50, db_index=True)
@@ -157,27 +254,84 @@ class TwitterUser(models.Model):
         return round(result, 2)
 
     def loads_tweet(self):
-        self.all_favorite_count = 0
-        self.all_retweet_count = 0
-        tweets = self.tweet_set.all()
-        self.all_tweet_count = tweets.count()
-        for tweet in tweets:
-            self.all_retweet_count += tweet.retweet_count()
-            self.all_favorite_count += tweet.favorite_count()
+        """
+        全ツイートの最新のTweetCountから集計値を計算し直す。集計は１回のSQLで行う。
+        通常の更新はadd_tweet_countsで差分だけ反映するので、集計値がずれた時の修復用。
+        """
+        totals = self.tweet_set.with_latest_counts().aggregate(
+            tweet_count=Count('pk'),
+            retweet_count=Sum('latest_retweet_count'),
+            favorite_count=Sum('latest_favorite_count'))
+        self.all_tweet_count = totals['tweet_count']
+        self.all_retweet_count = totals['retweet_count'] or 0
+        self.all_favorite_count = totals['favorite_count'] or 0
         self.save()
 
+    def add_tweet_counts(self, tweet_count, retweet_count, favorite_count):
+        """
+        保存したツイートの差分だけ集計値に加算する
+        :param tweet_count: int 新しく追加したツイート数
+        :param retweet_count: int リツイート数の増減
+        :param favorite_count: int いいね数の増減
+        """
+        self.all_tweet_count = F('all_tweet_count') + tweet_count
+        self.all_retweet_count = F('all_retweet_count') + retweet_count
+        self.all_favorite_count = F('all_favorite_count') + favorite_count
+        fields = ['all_tweet_count', 'all_retweet_count', 'all_favorite_count']
+        self.save(update_fields=fields + ['update_date'])
+        self.refresh_from_db(fields=fields)
+
     def latest_tweet(self):
         return self.tweet_set.order_by('-tweet_date')[0]
 
     def popular_tweet(self):
-        start_datetime = TwitterApi.start_datetime()
-        tweets = {tweet.latest_tweet_count().appraise(): tweet for tweet in
-                  self.tweet_set.filter(tweet_date__gte=start_datetime).prefetch_related('tweetcount_set')}
-        return sorted(tweets.items(), reverse=True)[0]
+        """
+        今期のツイートの中で一番ポイントの高いツイートを返す
+        :return tuple: (ポイント, tweet) 今期のツイートがなければNone
+        """
+        series = self.tweet_series(quarter_start_datetime())
+        if not len(series):
+            return None
+        points = series.points()
+        index = points.argmax()
+        return float(points[index]), Tweet.objects.get(
+            pk=series.tweet_pks[index])
+
+    def tweet_series(self, start=None, end=None):
+        """
+        期間内のツイートと最新のリツイート数・いいね数を１回のクエリで取得する
+        :param start: datetime この日時以降のツイートを対象にする
+        :param end: datetime この日時より前のツイートを対象にする
+        :return TweetSeries:
+        """
+        # NumPyはグラフや詳細ページでしか使わないので、起動時にはimportしない
+        from .series import TweetSeries
+        tweets = self.tweet_set.all()
+        if start:
+            tweets = tweets.filter(tweet_date__gte=start)
+        if end:
+            tweets = tweets.filter(tweet_date__lt=end)
+        return TweetSeries.from_queryset(tweets)
 
     # def display_popular_tweet(self):
 
 
+class TweetQuerySet(models.QuerySet):
+
+    def with_latest_counts(self):
+        """
+        最新のTweetCountのリツイート数・いいね数をサブクエリで取得し、
+        latest_retweet_count、latest_favorite_countとしてannotateする
+        """
+        latest = TweetCount.objects.filter(
+            tweet=OuterRef('pk')).order_by('-create_date', '-pk')
+        return self.annotate(
+            latest_retweet_count=Subquery(
+                latest.values('retweet_count')[:1]),
+            latest_favorite_count=Subquery(
+                latest.values('favorite_count')[:1]))
+
+
 class Tweet(models.Model):
     tweet_id = models.CharField('ツイートID', unique=True, max_length=100)
     text = models.TextField('内容')
@@ -185,6 +339,8 @@ class Tweet(models.Model):
                                      verbose_name='Twitterデータ')
     tweet_date = models.DateTimeField('ツイート日')
 
+    objects = TweetQuerySet.as_manager()
+
     def latest_tweet_count(self):
         return self.tweetcount_set.order_by('-create_date')[0]
 
@@ -200,8 +356,15 @@ class TweetCount(models.Model):
                               verbose_name='ツイート')
     retweet_count = models.PositiveIntegerField('リツート数')
     favorite_count = models.PositiveIntegerField('いいね数')
+    # リツイート数・いいね数が変わった時だけ作るので、最後に取得した日時ではなく最後に変わった日時になる。
+    # 最後に取得した日時はSyncCursor.last_sync_atに記録する
     create_date = models.DateTimeField('ツイート取得日', auto_now_add=True)
 
+    class Meta:
+        # ツイートごとの最新のTweetCountを探すための索引
+        indexes = [models.Index(fields=['tweet', '-create_date'],
+                                name='tweetcount_latest_idx')]
+
     def appraise(self):
         """
         （いいねx1 ＋ リツイートx2）/100の計算式でランキングのための数値を算出しています。
@@ -215,545 +378,67 @@ class TweetCount(models.Model):
             return 0
 
 
-TIMELINE_COUNT = '200'
-TIMELINE_TRIM_USER = 'true'
-TIMELINE_INCLUDE_RTS = 'false'
-
-
-class TwitterApi(object):
-    def __init__(self):
-        env = environ.Env()
-        environ.Env.read_env('.env')
-        self.__consumer_key = env('CONSUMER_KEY')
-        self.__consumer_secret = env('CONSUMER_SECRET')
-        self.__access_token = env('ACCESS_TOKEN')
-        self.__secret_token = env('SECRET_TOKEN')
-        self.__api = self.auth_twitter()
-
-    def auth_twitter(self):
-        api = OAuth1Session(self.__consumer_key,
-                            self.__consumer_secret,
-                            self.__access_token,
-                            self.__secret_token)
-        return api
-
-    def get_base(self, url, query_dict):
-        response = self.__api.get(url, params=query_dict)
-        result = json.loads(response.text)
-        time.sleep(1)
-        return result
-
-    def get_simple_timeline(self, screen_name, max_id=None, since_id=None):
-        timeline_url = "https://api.twitter.com/1.1/statuses/user_timeline.json"
-        query = {
-            "screen_name": screen_name,
-            "count": TIMELINE_COUNT,
-            "trim_user": TIMELINE_TRIM_USER,
-            "include_rts": TIMELINE_INCLUDE_RTS}
-        if max_id or max_id == 0:
-            query["max_id"] = max_id
-        if since_id:
-            query["since_id"] = since_id
-        return self.get_base(timeline_url, query)
-
-    def get_most_timeline(self, screen_name, since_id=None):
-        timeline = self.get_simple_timeline(screen_name, since_id=since_id)
-        next_id = timeline[-1]["id"] - 1
-        while True:
-            result = self.get_simple_timeline(screen_name, max_id=next_id,
-                                              since_id=since_id)
-            timeline.extend(result)
-            if result:
-                next_id = result[-1]["id"] - 1
-            else:
-                break
-        return timeline
-
-    def get_user(self, screen_name):
-        user_url = "https://api.twitter.com/1.1/users/show.json"
-        query = {"screen_name": screen_name}
-        return self.get_base(user_url, query)
-
-    @staticmethod
-    def store_user(screen_name, user_data, content=None):
-        """
-        get_userメソッドで取得したデータを元にTwitterUserモデル作成・アップデートする
-        :param screen_name: str
-        :param user_data: list　
-        :param content: obj　コンテンツがあればTwitterUserのupdate、なければcreateになる
-        :return TwitterUser: obj
-        """
-        if not content:
-            content = Content.objects.get(screen_name=screen_name)
-        twitter_user_args = {}
-        fields_list = ['name', 'url', 'description', 'profile_image_url_https',
-                       'profile_banner_url', 'followers_count']
-        for attr_key, attr_value in user_data.items():
-            if attr_key in fields_list:
-                if attr_key == 'profile_image_url_https':
-                    twitter_user_args['icon_url'] = attr_value
-                elif attr_key == 'url':
-                    twitter_user_args['official_url'] = attr_value
-                elif attr_key == 'profile_banner_url':
-                    twitter_user_args['banner_url'] = attr_value
-                else:
-                    twitter_user_args[attr_key] = attr_value
-        return TwitterUser.objects.update_or_create(
-            defaults=twitter_user_args, content=content)[0]
-
-    @staticmethod
-    def store_timeline_data(timeline_data, twitter_user):
-        """
-        get_timelineメソッドで取得したデータをTwitterUserとTweetに保存する
-        :param timeline_data: list
-        :param twitter_user: obj
-        """
-        if timeline_data:
-            for tweet in timeline_data:
-                tweet_time = tweet['created_at']
-                converted_time = datetime.strptime(
-                    tweet_time, '%a %b %d %H:%M:%S %z %Y')
-                tweet_args = {'twitter_user': twitter_user,
-                              'tweet_date': converted_time,
-                              'text': tweet['text']}
-                new_tweet = Tweet.objects.update_or_create(
-                    defaults=tweet_args, tweet_id=tweet['id_str'])[0]
-                TweetCount.objects.create(
-                    tweet=new_tweet, retweet_count=tweet['retweet_count'],
-                    favorite_count=tweet['favorite_count'])
-            twitter_user.loads_tweet()
+class SyncCursor(models.Model):
+    """
+    TwitterUserごとのタイムラインの取得状況。次の更新ではnewest_idより新しいツイートと、
+    まだ反応が増えている最近のツイートだけを取得する。
+    """
+    twitter_user = models.OneToOneField(TwitterUser, on_delete=models.CASCADE,
+                                        verbose_name='Twitterデータ')
+    newest_id = models.BigIntegerField('取得済みの最新ツイートID', null=True,
+                                       blank=True)
+    last_sync_at = models.DateTimeField('最終取得日', null=True, blank=True)
 
-    @transaction.atomic
-    def get_and_store_twitter_data(self, content):
-        """
-        TwitterAPIからデータを取得して,TwitterUserとTweetのモデルを新規作成する
-        :param content: obj
+    def __str__(self):
+        return '{} : {}'.format(self.twitter_user, self.newest_id)
+
+    @classmethod
+    def record(cls, twitter_user, newest_id=None):
         """
-        screen_name = content.screen_name
-        if screen_name:
-            user_data = self.get_user(screen_name)
-            timeline_data = self.get_most_timeline(screen_name)
-            twitter_user = self.store_user(screen_name, user_data)
-            self.store_timeline_data(timeline_data, twitter_user)
+        取得したツイートの最新IDと取得日時を記録する
+        :param twitter_user: obj
+        :param newest_id: int 今回取得したツイートの最新ID
+        :return SyncCursor:
+        """
+        cursor = cls.objects.get_or_create(twitter_user=twitter_user)[0]
+        if newest_id and (cursor.newest_id or 0) < newest_id:
+            cursor.newest_id = newest_id
+        cursor.last_sync_at = timezone.now()
+        cursor.save()
+        return cursor
+
+
+class FetchFailure(models.Model):
+    """
+    Twitterデータの取得に失敗したコンテンツ。失敗が続くアカウントの更新の優先度を下げるために
+    失敗回数と最後に失敗した日時を記録し、取得できたら削除する。
+    """
+    content = models.OneToOneField(Content, on_delete=models.CASCADE,
+                                   verbose_name='作品')
+    failure_count = models.PositiveIntegerField('失敗回数', default=0)
+    last_failed_at = models.DateTimeField('最終失敗日')
 
-    def get_updated_timeline(self, screen_name, twitter_user, start_datetime):
-        target_tweet = twitter_user.tweet_set.filter(
-            tweet_date__gte=start_datetime).order_by('tweet_date')[0]
-        since_id = int(target_tweet.tweet_id) - 1
-        timeline_data = self.get_most_timeline(screen_name, since_id=since_id)
-        return timeline_data
+    def __str__(self):
+        return '{} : {}回'.format(self.content, self.failure_count)
 
     @classmethod
-    def start_datetime(cls):
-        ja_tz = timezone('Asia/Tokyo')
-        current_month = datetime.now().month
-        current_year = datetime.now().year
-        if current_month in [1, 2, 3]:
-            return datetime(current_year, 1, 1, tzinfo=ja_tz)
-        elif current_month in [4, 5, 6]:
-            return datetime(current_year, 4, 1, tzinfo=ja_tz)
-        elif current_month in [7, 8, 9]:
-            return datetime(current_year, 7, 1, tzinfo=ja_tz)
-        elif current_month in [10, 11, 12]:
-            return datetime(current_year, 10, 1, tzinfo=ja_tz)
-
-    @transaction.atomic
-    def update_data(self, content):
+    def record(cls, content):
         """
-        TwitterAPIからのデータを取得して、TwitterUserとTweetのモデルをアップデートする
+        取得に失敗したことを記録する
         :param content: obj
+        :return FetchFailure:
         """
-        screen_name = content.screen_name
-        twitter_user = content.twitteruser
-        start_datetime = self.start_datetime()
-        timeline = self.get_updated_timeline(screen_name, twitter_user,
-                                             start_datetime)
-        user_data = self.get_user(screen_name)
-        updated_twitter_user = self.store_user(screen_name, user_data, content)
-        self.store_timeline_data(timeline, updated_twitter_user)
-
-
-ANIME_TOP_DOMAIN = 'https://anime.eiga.com'
-DRAMA_PART1_DOMAIN = 'https://thetv.jp'
-DRAMA_PART1_PATH = "/program/selection/316/"
-DRAMA_PART2_DOMAIN = "https://drama-circle.com/"
-EXCLUSION_LIST = ['share', 'bs7ch_pr', 'tvtokyo_pr', 'intent', 'search']
-EXCLUSION_ANIME_IMG = ["https://eiga.k-img.com/anime/images/shared/noimg/320.png?1484793255"]
-
-
-class ScrapingContent(object):
-    def __init__(self):
-        self.contents_data = []
-        self.contents = []
-
-    @staticmethod
-    def create_url(url='', anime_default=False, drama_default1=False):
-        if anime_default:
-            url = ANIME_TOP_DOMAIN + url
-        elif drama_default1:
-            url = DRAMA_PART1_DOMAIN + url
-        return url
-
-    @staticmethod
-    def get_html_from(url):
-        http = urllib3.PoolManager()
-        response = http.request('GET', url)
-        return response
-
-    def extra_drama_part1_data_from(self, response):
-        """
-        名前、あらすじ、画像URL、スタッフ情報、キャスト情報を取得するメソッド
-        :return list:
-            [dict, dict, ...., dict]
-        """
-        soup = BeautifulSoup(response.data, 'lxml')
-        url_list = self.extra_drama_part1_url(soup)
-        next_page_path = soup.select_one('ul.pageNav > li.nextPage > a')['href']
-        next_page_url = self.create_url(next_page_path, drama_default1=True)
-        time.sleep(1)
-        next_response = self.get_html_from(next_page_url)
-        next_soup = BeautifulSoup(next_response.data, 'lxml')
-        url_list_of_next_page = self.extra_drama_part1_url(next_soup)
-        url_list.extend(url_list_of_next_page)
-        contents_list = []
-        for detail_url in url_list:
-            time.sleep(1)
-            detail_response = self.get_html_from(detail_url)
-            detail_data = self.extra_drama_part1_detail_data_from(
-                detail_response)
-            contents_list.append(detail_data)
-        return contents_list
-
-    @staticmethod
-    def extra_drama_part1_detail_data_from(response):
-        """
-        :return dict:
-          {name: (text), description: (text), img_url: (text),
-          cast: list[role, name], staff: list[role, name]}
-        """
-        detail_soup = BeautifulSoup(response.data, 'lxml')
-        name = detail_soup.select_one(
-            '#top > div.cp_cont__h > div > div.pp_prg_hdr__grid_1_1 > h1 >'
-            ' span.pp_prg_name__ttl').text.replace('\u3000', '')
-        description = detail_soup.select_one(
-            '#top > div.cp_cont__b > div.pp_prg_data > '
-            'div.pp_prg_data__grid_1_1 > p.pp_prg_plot').text
-        img_url_data = detail_soup.select_one(
-            '#top > div.cp_cont__b > div.pp_prg_data >'
-            ' div.pp_prg_data__grid_1_2 > img')
-        cast_data = detail_soup.find_all('div', class_="cp_cast__txt")
-        cast_list = []
-        pattern = r'役'
-        repatter = re.compile(pattern)
-        for cast_tag in cast_data:
-            cast_name_data = cast_tag.find('span', class_="cp_cast__name")
-            cast_role_data = cast_tag.find('p', class_="cp_cast__char")
-            if cast_name_data and cast_role_data:
-                cast_role = cast_role_data.text
-                if repatter.search(cast_role):
-                    cast_role = cast_role[:-1]
-                cast_list.append('{}:{}'.format(cast_role, cast_name_data.text))
-        staff_data = detail_soup.find_all('li', class_="cp_stf_ls__i")
-        staff_list = []
-        for staff_tag in staff_data:
-            staff_name_data = staff_tag.find('span', class_="cp_stf__n")
-            staff_role_data = staff_tag.find('span', class_="cp_stf__r")
-            if staff_name_data and staff_role_data:
-                staff_list.append('{}:{}'.format(
-                    staff_role_data.text, staff_name_data.text))
-        contents_dict = {'name': name, 'description': description}
-        if img_url_data:
-            contents_dict['img_url'] = img_url_data['src']
-        if cast_list:
-            contents_dict['cast'] = cast_list
-        if staff_list:
-            contents_dict['staff'] = staff_list
-        return contents_dict
-
-    def extra_drama_part1_url(self, soup):
-        url_list = []
-        contents_boxes = soup.select(
-            'div.contentBody.programContent.cn_prg_selections > '
-            'ul.listContent.programList > li.listItem.largeItem')
-        for box in contents_boxes:
-            a_tag = box.find('a')
-            if a_tag:
-                url_path = a_tag['href']
-                url = self.create_url(url_path, drama_default1=True)
-                url_list.append(url)
-        return url_list
-
-    def extra_drama_part2_data_from(self, response):
-        """
-        作品名、公式URL、screen_name、放送開始日を取得するメソッド
-        :return list: ここで取得したcontent情報のリスト
-            [dict, dict, ..., dict]
-        """
-        soup = BeautifulSoup(response.data, 'lxml')
-        drama_boxes = soup.select(
-            '#new-season > #season-drama > .day-dramas > ul')
-        contents_list = []
-        if drama_boxes:
-            for item in drama_boxes:
-                a_tag = item.find('a')
-                if a_tag:
-                    detail_page_url = a_tag['href']
-                    time.sleep(1)
-                    details_page_response = self.get_html_from(detail_page_url)
-                    content_dict = self.extra_drama_detail_part2_data_from(
-                        details_page_response)
-                    contents_list.append(content_dict)
-        return contents_list
-
-    @staticmethod
-    def extra_drama_detail_part2_data_from(response):
-        """
-        :return: dict
-            {name: (text), official_url: (text), screen_name: (text),
-            release_date: (time_date), maker: (text)}
-        """
-        soup = BeautifulSoup(response.data, 'lxml')
-        all_info = soup.find_all('ul', class_='square')
-        basic_info = all_info[0].find_all('li')
-        content_dict = {}
-        pattern = r'https://twitter.com/(\w+)(\?\w+=\w+)?'
-        repatter = re.compile(pattern)
-        for li in basic_info:
-            if 'タイトル：' in li.text:
-                content_dict['name'] = re.split('：', li.text)[1]
-            if 'ドラマ公式URL' in li.text:
-                content_dict['official_url'] = li.find('a')['href']
-            if 'ドラマ公式Twitter' in li.text:
-                screen_name_data = repatter.match(li.find('a')['href'])
-                content_dict['screen_name'] = screen_name_data.groups()[0]
-            if '放映日時' in li.text:
-                date_and_time = re.split(' ', li.text)[1]
-                if '放送開始日' in li.text:
-                    year_and_month = re.split('：', li.text)[1]
-                    release_time_date = year_and_month + " " + date_and_time
-                    native_date = datetime.strptime(release_time_date,
-                                                    '%Y年%m月%d日 %H:%M')
-                    content_dict['release_date'] = timezone(
-                        'Asia/Tokyo').localize(native_date)
-        maker_info = all_info[-1]
-        maker_text = maker_info.find_all('li')[-1].text
-        content_dict['maker'] = re.split('：', maker_text)[1]
-        return content_dict
-
-    def combine(self, contents_list1, contents_list2):
-        combined_list = []
-        for part2 in contents_list2:
-            for part1 in contents_list1:
-                if part1['name'].startswith(part2['name']):
-                    part1.update(part2)
-                    combined_list.append(part1)
-        return combined_list
-
-    def extra_anime_data_from(self, response):
-        """
-        :return self.contents_data (list):
-            [dict, dict, ... dict]
-
-            ＊dictの内容
-            {name: (text), maker: (text), description: (text),
-            cast: list[(text)], official_url: (text), staff: list[(text)],
-            img_url: (text), screen_name: (text)}
-        """
-        soup = BeautifulSoup(response.data, 'lxml')
-        anime_boxes = soup.find_all('div', {'class': 'animeSeasonBox'})
-        if anime_boxes:
-            for box in anime_boxes:
-                p_tag = box.find('p', 'seasonAnimeTtl')
-                content_dict = {'name': p_tag.text}
-                detail_url = p_tag.find('a')['href']
-                maker_tag = box.select('dt:contains("制作会社") ~ dd')
-                if maker_tag:
-                    content_dict['maker'] = maker_tag[0].text
-                url = self.create_url(detail_url, anime_default=True)
-                html_data = self.get_html_from(url)
-                soup = BeautifulSoup(html_data.data, 'lxml')
-                description_data = soup.select_one('#detailSynopsis > dd')
-                cast_data = soup.select_one(
-                    '#detailCast > dd > ul:nth-child(1)')
-                official_url = soup.select_one('#detailLink > dd > ul > li > a')
-                staff = soup.select_one('#detailStaff > dd')
-                img_data = soup.select_one(
-                    '#main > div:nth-child(1) > div.articleInner > div > div'
-                    '> div.animeDetailBox.clearfix > div.animeDetailImg > img')
-                screen_name = self.get_screen_name_from(official_url.text)
-                if description_data:
-                    content_dict['description'] = description_data.text
-                if cast_data:
-                    cast = [person.text for person in cast_data.find_all('li')]
-                    content_dict['cast'] = cast
-                content_dict['official_url'] = official_url.text
-                if staff:
-                    staff_list = [item.text for item in staff.find_all('li')]
-                    content_dict['staff'] = staff_list
-                if img_data:
-                    if img_data['src'] in EXCLUSION_ANIME_IMG:
-                        content_dict['img_url'] = None
-                    else:
-                        content_dict['img_url'] = img_data['src']
-                if screen_name:
-                    content_dict['screen_name'] = screen_name
-
-                self.contents_data.append(content_dict)
-                time.sleep(1)
-        return self.contents_data
-
-    def get_screen_name_from(self, url):
-        """
-        引数のURLのサイトからtwitterのIDを抜き取り返す
-        :param url:
-        :return　str: screen_name
-        """
-        response = self.get_html_from(url)
-        soup = BeautifulSoup(response.data, 'lxml')
-        pattern = r'https://twitter.com/(\w+)(\?\w+=\w+)?'
-        repatter = re.compile(pattern)
-        a_tag_list = soup.find_all('a', {'href': repatter})
-        screen_name = None
-        if a_tag_list:
-            extract_a_tag_list = [
-                repatter.match(attr['href']).groups()[0].lower() for attr in
-                a_tag_list]
-            correct_a_tag = []
-            for word in extract_a_tag_list:
-                if word not in EXCLUSION_LIST:
-                    correct_a_tag.append(word)
-            if correct_a_tag:
-                screen_name = Counter(correct_a_tag).most_common()[0][0]
-        return screen_name
-
-    # TODO (3) 取得できなかった情報について、release_dateについて
-    @transaction.atomic
-    def store_contents_data(self, category, anime=False, drama=False):
-        """
-        引数のデータをcontentモデル・staffモデルとして保存する。
-        :param category: obj
-        :param anime: Boolean
-        :param drama: Boolean
-        """
-        if self.contents_data:
-            for content_data in self.contents_data:
-                fields_list = ['name', 'description', 'maker', 'screen_name',
-                               'img_url']
-                content_args = {'category': category}
-                for attr_key, attr_value in content_data.items():
-                    if attr_key in fields_list:
-                        content_args[attr_key] = attr_value
-                new_content = Content.objects.create(**content_args)
-                self.contents.append(new_content)
-                if anime:
-                    self.store_anime_staff(content_data, new_content)
-                if drama:
-                    self.store_drama_staff(content_data, new_content)
-
-    @staticmethod
-    def store_anime_staff(content_dict, content):
-        """
-        :param content_dict: 取得したコンテンツのdict
-        :param content: スタッフ情報を保存するコンテンツ
-        """
-        if 'staff' in content_dict:
-            role_and_name = [re.split('[【】、]', person)
-                             for person in content_dict['staff']]
-            for item in role_and_name:
-                staff_args = {'name': item[2], 'role': item[1],
-                              'content': content}
-                Staff.objects.create(**staff_args)
-                limit = len(item) - 3
-                for num in range(limit):
-                    staff_args = {'role': item[1],
-                                  'name': item[num + 3],
-                                  'content': content}
-                    Staff.objects.create(**staff_args)
-        if 'cast' in content_dict:
-            role_and_name = [
-                person.split('：') for person in content_dict['cast']]
-            for person in role_and_name:
-                staff_args = {'role': person[0], 'name': person[1],
-                              'content': content, 'is_cast': True}
-                Staff.objects.create(**staff_args)
-
-    @staticmethod
-    def store_drama_staff(content_dict, content):
-        if 'staff' in content_dict:
-            role_and_name = [re.split(':', person)
-                             for person in content_dict['staff']]
-            for person in role_and_name:
-                staff_args = {'name': person[1], 'role': person[0],
-                              'content': content}
-                Staff.objects.create(**staff_args)
-        if 'cast' in content_dict:
-            role_and_name = [
-                person.split(':') for person in content_dict['cast']]
-            for person in role_and_name:
-                staff_args = {'name': person[1], 'role': person[0],
-                              'content': content, 'is_cast': True}
-                Staff.objects.create(**staff_args)
-
-    @transaction.atomic
-    def get_anime_data(self):
-        """
-        アニメに関する情報を取得しモデルを新規作成する
-        :return: list 取得したデータ
-        """
-        url = self.create_url('/program', anime_default=True)
-        response = self.get_html_from(url)
-        self.extra_anime_data_from(response)
-        anime_category = Category.objects.get(name='アニメ')
-        self.store_contents_data(anime_category, anime=True)
-        return self
+        failure = cls.objects.get_or_create(
+            content=content, defaults={'last_failed_at': timezone.now()})[0]
+        failure.failure_count += 1
+        failure.last_failed_at = timezone.now()
+        failure.save()
+        return failure
 
-    @transaction.atomic
-    def get_drama_data(self):
+    @classmethod
+    def clear(cls, content):
         """
-        ドラマに関する情報を取得しモデルを作成する
-        :return:
+        取得できたので失敗の記録を削除する
+        :param content: obj
         """
-        url = self.create_url(DRAMA_PART1_PATH, drama_default1=True)
-        response_part1 = self.get_html_from(url)
-        part1_contents_list = self.extra_drama_part1_data_from(response_part1)
-        response_part2 = self.get_html_from(DRAMA_PART2_DOMAIN)
-        part2_contents_list = self.extra_drama_part2_data_from(response_part2)
-        self.contents_data = self.combine(
-            part1_contents_list, part2_contents_list)
-        drama_category = Category.objects.get(name='ドラマ')
-        self.store_contents_data(drama_category, drama=True)
-        return self
-
-
-class Graph(object):
-
-    def __init__(self):
-        self.ax = None
-        self.svg = None
-
-    def set_rank_graph(self, content):
-        start = TwitterApi.start_datetime()
-        tweet_list = content.twitteruser.tweet_set.filter(
-            tweet_date__gte=start).order_by('-tweet_date')
-        x, y = [], []
-        for tweet in tweet_list:
-            x.append(tweet.latest_tweet_count().appraise())
-            y.append(tweet.tweet_date)
-        ja_tz = timezone('Asia/Tokyo')
-        self.ax = plt.subplot()
-        self.ax.plot(y, x)
-        date_format = mdates.DateFormatter("%m/%d")
-        date_interval = mdates.DayLocator(interval=5, tz=ja_tz)
-        self.ax.xaxis.set_major_locator(date_interval)
-        self.ax.xaxis.set_major_formatter(date_format)
-        self.ax.set_xlim(start, datetime.now(ja_tz))
-
-    def plt_to_svg(self):
-        buf = io.BytesIO()
-        plt.savefig(buf, format='svg', bbox_inches='tight')
-        self.svg = buf.getvalue()
-        buf.close()
-        return self.svg
-
-    def plt_clean(self):
-        plt.cla()
+        cls.objects.filter(content=content).delete()
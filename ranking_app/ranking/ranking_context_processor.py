@@ -1,6 +1,8 @@
-from .models import Category
+from .registry import category_registry
+from .utils import get_ranking_generation
 
 
 def common(request):
-    categories = Category.objects.all()
-    return {"categories": categories}
+    categories = category_registry.all()
+    return {"categories": categories,
+            "ranking_generation": get_ranking_generation()}
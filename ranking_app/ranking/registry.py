@@ -0,0 +1,47 @@
+import threading
+import time
+
+from .models import Category
+
+# カテゴリー一覧を読み込み直すまでの時間(秒)。他のプロセスで変更された時もこの時間で反映される
+CATEGORY_REGISTRY_TTL = 60 * 5
+
+
+class CategoryRegistry(object):
+    """
+    カテゴリー一覧をプロセス内に保持する。カテゴリーはほとんど変わらないので、
+    リクエストごとにクエリを発行せず、ttl秒ごとかカテゴリーを保存・削除した時に読み込み直す。
+    """
+
+    def __init__(self, ttl=CATEGORY_REGISTRY_TTL):
+        self.ttl = ttl
+        self._categories = None
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    def all(self):
+        """
+        :return list: 全カテゴリー
+        """
+        with self._lock:
+            if self._categories is None or \
+                    time.monotonic() - self._loaded_at > self.ttl:
+                self._categories = list(Category.objects.all())
+                self._loaded_at = time.monotonic()
+            return self._categories
+
+    def get(self, pk):
+        """
+        idからカテゴリーを返す。一覧になければDBから取得する
+        """
+        for category in self.all():
+            if category.pk == pk:
+                return category
+        return Category.objects.get(pk=pk)
+
+    def invalidate(self, **kwargs):
+        with self._lock:
+            self._categories = None
+
+
+category_registry = CategoryRegistry()
@@ -0,0 +1,167 @@
+from datetime import timedelta
+import math
+
+from django.conf import settings
+from django.db.models import Count
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import Tweet
+
+# スコアの重み。最近のツイート数(1日あたり)、反応の増え方(1日あたりのポイント)、放送日の近さ
+SCHEDULE_TWEET_RATE_WEIGHT = 1.0
+SCHEDULE_VELOCITY_WEIGHT = 1.0
+SCHEDULE_RELEASE_WEIGHT = 2.0
+# 動きのないアカウントにも付けるスコア。古くなれば順番が回ってくる
+SCHEDULE_BASE_ACTIVITY = 0.1
+# 放送日からこの日数離れると放送日の近さのスコアが半分になる
+SCHEDULE_RELEASE_HALF_DAYS = 7
+# 一度も取得していないアカウントの古さ(日)
+SCHEDULE_NEVER_SYNCED_DAYS = 30
+# 一度も取得できていないアカウントが取得に失敗した後のスコア(1日あたり)。失敗するたびに半分にする
+SCHEDULE_FAILED_ACTIVITY = 1.0
+# ツイートを取得していないアカウントは全タイムラインを取得するので、その時のAPIの呼び出し回数
+FULL_FETCH_CALLS = 17
+TIMELINE_PAGE_SIZE = 200
+
+
+class RefreshCandidate(object):
+    """
+    更新候補のコンテンツと、スコア・APIの呼び出し回数の見積もり
+    """
+
+    def __init__(self, content, score, cost):
+        self.content = content
+        self.score = score
+        self.cost = cost
+
+    def __repr__(self):
+        return '<RefreshCandidate {} score={:.2f} cost={}>'.format(
+            self.content, self.score, self.cost)
+
+
+class RefreshScheduler(object):
+    """
+    TwitterUserごとに次の更新でどれだけデータが変わりそうかをスコアにして、
+    APIの呼び出し回数の予算内で更新するコンテンツを選ぶ。
+    スコアは(最近のツイート数 + 反応の増え方 + 放送日の近さ) × 前回の取得からの日数で、取得に失敗するたびに半分にする。
+    """
+
+    def __init__(self, active_days=None, now=None):
+        self.active_days = active_days or settings.TWEET_ACTIVE_DAYS
+        self.now = now or timezone.now()
+
+    def recent_activity(self, twitter_users):
+        """
+        最近のツイート数と、その最新のリツイート数・いいね数から計算したポイントの合計を１回のクエリで集計する
+        :return dict: {twitter_user_id: (ツイート数, ポイント)}
+        """
+        active_start = self.now - timedelta(days=self.active_days)
+        rows = Tweet.objects.filter(
+            twitter_user__in=twitter_users,
+            tweet_date__gte=active_start).with_latest_counts().values(
+            'twitter_user').annotate(
+            tweet_count=Count('pk'),
+            retweet_count=Sum('latest_retweet_count'),
+            favorite_count=Sum('latest_favorite_count')).values_list(
+            'twitter_user', 'tweet_count', 'retweet_count', 'favorite_count')
+        return {
+            twitter_user_id: (tweet_count, ((favorite_count or 0) +
+                                            (retweet_count or 0) * 2) / 100)
+            for twitter_user_id, tweet_count, retweet_count, favorite_count
+            in rows}
+
+    def staleness_days(self, twitter_user):
+        cursor = getattr(twitter_user, 'synccursor', None)
+        last_sync_at = cursor.last_sync_at if cursor else None
+        if last_sync_at is None:
+            return SCHEDULE_NEVER_SYNCED_DAYS
+        return max((self.now - last_sync_at).total_seconds(), 0) / 86400
+
+    def failure_penalty(self, content):
+        """
+        取得に失敗した回数だけスコアを半分にする
+        """
+        failure = getattr(content, 'fetchfailure', None)
+        return 0.5 ** failure.failure_count if failure else 1
+
+    def failed_score(self, content):
+        """
+        一度も取得できていないアカウントのスコア。最後の失敗からの日数に比例し、失敗が続くほど小さくなる
+        """
+        failure = content.fetchfailure
+        failed_days = max(
+            (self.now - failure.last_failed_at).total_seconds(), 0) / 86400
+        return SCHEDULE_FAILED_ACTIVITY * failed_days * \
+            0.5 ** (failure.failure_count - 1)
+
+    def release_proximity(self, content):
+        if not content.release_date:
+            return 0
+        days = abs((self.now.date() - content.release_date).days)
+        return SCHEDULE_RELEASE_HALF_DAYS / (SCHEDULE_RELEASE_HALF_DAYS + days)
+
+    def score(self, content, tweet_count, points):
+        """
+        :param content: obj
+        :param tweet_count: int active_days日以内のツイート数
+        :param points: float active_days日以内のツイートのポイントの合計
+        :return float:
+        """
+        tweet_rate = tweet_count / self.active_days
+        velocity = math.log1p(points / self.active_days)
+        activity = (SCHEDULE_TWEET_RATE_WEIGHT * tweet_rate +
+                    SCHEDULE_VELOCITY_WEIGHT * velocity +
+                    SCHEDULE_RELEASE_WEIGHT * self.release_proximity(content) +
+                    SCHEDULE_BASE_ACTIVITY)
+        return activity * self.staleness_days(content.twitteruser) * \
+            self.failure_penalty(content)
+
+    def cost(self, tweet_count, staleness_days):
+        """
+        更新に使うAPIの呼び出し回数を見積もる。ユーザー情報に1回、タイムラインに1ページ以上。
+        """
+        expected_tweets = tweet_count + \
+            tweet_count / self.active_days * staleness_days
+        return 1 + max(1, math.ceil(expected_tweets / TIMELINE_PAGE_SIZE))
+
+    def candidates(self, contents):
+        """
+        contentsをスコアの高い順に並べる
+        :param contents: contentのイテラブル。twitteruser、synccursor、fetchfailureはselect_relatedしておく
+        :return list: RefreshCandidateのlist
+        """
+        contents = [content for content in contents if content.screen_name]
+        twitter_users = [content.twitteruser for content in contents
+                         if content.has_tweets()]
+        activity = self.recent_activity(twitter_users)
+        candidates = []
+        for content in contents:
+            if not content.has_tweets():
+                # 取得に失敗したアカウントは、毎回の予算を使い切らないように有限のスコアにする
+                score = self.failed_score(content) if getattr(
+                    content, 'fetchfailure', None) else math.inf
+                candidates.append(
+                    RefreshCandidate(content, score, FULL_FETCH_CALLS))
+                continue
+            tweet_count, points = activity.get(content.twitteruser.pk, (0, 0))
+            candidates.append(RefreshCandidate(
+                content, self.score(content, tweet_count, points),
+                self.cost(tweet_count,
+                          self.staleness_days(content.twitteruser))))
+        candidates.sort(key=lambda candidate: -candidate.score)
+        return candidates
+
+    def pick(self, contents, budget):
+        """
+        APIの呼び出し回数がbudget以内になるように、スコアの高い順にコンテンツを選ぶ
+        :param contents: contentのイテラブル
+        :param budget: int APIの呼び出し回数の上限
+        :return list: 選んだRefreshCandidateのlist
+        """
+        picked = []
+        for candidate in self.candidates(contents):
+            if candidate.cost <= budget:
+                picked.append(candidate)
+                budget -= candidate.cost
+        return picked
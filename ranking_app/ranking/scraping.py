@@ -0,0 +1,616 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from pytz import timezone
+
+from bs4 import BeautifulSoup
+from django.db import transaction
+import urllib3
+
+from .models import Category
+from .models import Content
+from .models import Staff
+
+
+ANIME_TOP_DOMAIN = 'https://anime.eiga.com'
+DRAMA_PART1_DOMAIN = 'https://thetv.jp'
+DRAMA_PART1_PATH = "/program/selection/316/"
+DRAMA_PART2_DOMAIN = "https://drama-circle.com/"
+EXCLUSION_LIST = ['share', 'bs7ch_pr', 'tvtokyo_pr', 'intent', 'search']
+EXCLUSION_ANIME_IMG = ["https://eiga.k-img.com/anime/images/shared/noimg/320.png?1484793255"]
+# スクレイピングで使うHTTP接続の設定
+SCRAPING_NUM_POOLS = 10
+SCRAPING_MAXSIZE = 2
+SCRAPING_CONNECT_TIMEOUT = 5.0
+SCRAPING_READ_TIMEOUT = 30.0
+SCRAPING_RETRIES = 3
+SCRAPING_WORKERS = 8
+SCRAPING_HOST_DELAY = 1.0
+# 取得したページのキャッシュの有効期限(秒)と合計サイズの上限(バイト)
+SCRAPING_CACHE_TTL = 60 * 60 * 24
+SCRAPING_CACHE_MAX_BYTES = 200 * 1024 * 1024
+# 上限を超えたら、合計サイズが上限のこの割合になるまで削除する。上限の前後で毎回削除しないようにする
+SCRAPING_CACHE_EVICT_RATIO = 0.75
+
+
+class HostThrottle(object):
+    """
+    同じホストへのリクエストの間隔をdelay秒以上あける。別のホストへのリクエストは待たない。
+    """
+
+    def __init__(self, delay=SCRAPING_HOST_DELAY):
+        self.delay = delay
+        self.last_access = {}
+        self.host_locks = {}
+        self.lock = threading.Lock()
+
+    def wait(self, url):
+        host = urllib3.util.parse_url(url).host
+        with self.lock:
+            host_lock = self.host_locks.setdefault(host, threading.Lock())
+        with host_lock:
+            if host in self.last_access:
+                wait_seconds = self.last_access[host] + self.delay - \
+                               time.monotonic()
+                if wait_seconds > 0:
+                    time.sleep(wait_seconds)
+            self.last_access[host] = time.monotonic()
+
+
+class ScrapingCacheMiss(Exception):
+    """
+    オフラインモードでキャッシュにないページを取得しようとした時の例外
+    """
+
+
+class CachedResponse(object):
+    """
+    ResponseCacheから取り出したレスポンス。urllib3のレスポンスと同じようにdataで本文を参照できる。
+    """
+
+    def __init__(self, url, data, headers, fetched_at):
+        self.url = url
+        self.data = data
+        self.headers = headers
+        self.fetched_at = fetched_at
+        self.status = 200
+
+
+class ResponseCache(object):
+    """
+    取得したページをURLごとにディスクへ保存するキャッシュ。
+    ttl秒以内のページはそのまま返し、古いページはETag・Last-Modifiedを使って更新を確認する。
+    合計サイズは書き込むたびに足していき、max_bytesを超えた時だけディレクトリを調べて、
+    最後に使われたのが古いページからmax_bytes×SCRAPING_CACHE_EVICT_RATIOまで削除する。
+    """
+
+    def __init__(self, directory, ttl=SCRAPING_CACHE_TTL,
+                 max_bytes=SCRAPING_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # 最初に書き込む時にディレクトリを調べて求める
+        self.total_bytes = None
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, url, extension):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, '{}.{}'.format(key, extension))
+
+    def get(self, url):
+        """
+        :return CachedResponse: キャッシュがなければNone
+        """
+        try:
+            with open(self.path(url, 'json'), encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(self.path(url, 'body'), 'rb') as f:
+                data = f.read()
+        except (OSError, ValueError):
+            return None
+        return CachedResponse(url, data, meta['headers'], meta['fetched_at'])
+
+    def is_fresh(self, response):
+        return time.time() - response.fetched_at < self.ttl
+
+    @staticmethod
+    def conditional_headers(response):
+        """
+        キャッシュしたページが更新されているか確認するためのリクエストヘッダーを返す
+        """
+        headers = {}
+        if response:
+            if response.headers.get('etag'):
+                headers['If-None-Match'] = response.headers['etag']
+            if response.headers.get('last-modified'):
+                headers['If-Modified-Since'] = response.headers['last-modified']
+        return headers
+
+    def set(self, url, data, headers):
+        meta = {'url': url, 'fetched_at': time.time(), 'headers': {
+            key.lower(): value for key, value in headers.items()
+            if key.lower() in ('etag', 'last-modified')}}
+        with self.lock:
+            if self.total_bytes is None:
+                self.total_bytes = sum(size for _, size, _ in self.entries())
+            body_path = self.path(url, 'body')
+            try:
+                self.total_bytes -= os.stat(body_path).st_size
+            except OSError:
+                pass
+            self.write(body_path, data)
+            self.write(self.path(url, 'json'),
+                       json.dumps(meta).encode('utf-8'))
+            self.total_bytes += len(data)
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def touch(self, url, revalidated=False):
+        """
+        最後に使われた時刻を更新する。revalidatedなら取得日時も更新してttlを延ばす。
+        """
+        with self.lock:
+            if revalidated:
+                response = self.get(url)
+                if response:
+                    meta = {'url': url, 'fetched_at': time.time(),
+                            'headers': response.headers}
+                    self.write(self.path(url, 'json'),
+                               json.dumps(meta).encode('utf-8'))
+            try:
+                os.utime(self.path(url, 'body'))
+            except OSError:
+                pass
+
+    @staticmethod
+    def write(path, data):
+        tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def entries(self):
+        """
+        :return list: キャッシュしたページの(最後に使われた時刻, サイズ, パス)
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.body'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        entries = self.entries()
+        total_bytes = sum(size for _, size, _ in entries)
+        target_bytes = self.max_bytes * SCRAPING_CACHE_EVICT_RATIO
+        for _, size, body_path in sorted(entries):
+            if total_bytes <= target_bytes:
+                break
+            for path in (body_path, body_path[:-len('body')] + 'json'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total_bytes -= size
+        self.total_bytes = total_bytes
+
+
+class ScrapingContent(object):
+    _pool_manager = None
+
+    def __init__(self, http=None, workers=SCRAPING_WORKERS,
+                 host_delay=SCRAPING_HOST_DELAY, cache=None, offline=False):
+        """
+        :param http: obj urllib3.PoolManagerなど。なければ全インスタンスで共有するものを使う
+        :param workers: int 並行してページを取得する数
+        :param host_delay: float 同じホストへのリクエストの間隔(秒)
+        :param cache: obj ResponseCache
+        :param offline: Boolean Trueならリクエストせずにキャッシュのページだけを使う
+        """
+        self.contents_data = []
+        self.contents = []
+        self.http = http or self.get_pool_manager()
+        self.workers = workers
+        self.throttle = HostThrottle(host_delay)
+        self.cache = cache
+        self.offline = offline
+        self.fetch_count = 0
+        self.fetch_bytes = 0
+        self.cache_hit_count = 0
+        self.stats_lock = threading.Lock()
+
+    @classmethod
+    def get_pool_manager(cls):
+        """
+        ホストごとに接続を使い回すPoolManagerを返す。同じホストへのリクエストでは
+        TCP・TLSの接続をやり直さずに済む。
+        """
+        if cls._pool_manager is None:
+            cls._pool_manager = urllib3.PoolManager(
+                num_pools=SCRAPING_NUM_POOLS, maxsize=SCRAPING_MAXSIZE,
+                block=True,
+                timeout=urllib3.Timeout(connect=SCRAPING_CONNECT_TIMEOUT,
+                                        read=SCRAPING_READ_TIMEOUT),
+                retries=urllib3.Retry(total=SCRAPING_RETRIES,
+                                      backoff_factor=1,
+                                      status_forcelist=[500, 502, 503, 504]))
+        return cls._pool_manager
+
+    @staticmethod
+    def create_url(url='', anime_default=False, drama_default1=False):
+        if anime_default:
+            url = ANIME_TOP_DOMAIN + url
+        elif drama_default1:
+            url = DRAMA_PART1_DOMAIN + url
+        return url
+
+    def get_html_from(self, url):
+        cached = self.cache.get(url) if self.cache else None
+        if cached and (self.offline or self.cache.is_fresh(cached)):
+            self.cache.touch(url)
+            with self.stats_lock:
+                self.cache_hit_count += 1
+            return cached
+        if self.offline:
+            raise ScrapingCacheMiss(url)
+        self.throttle.wait(url)
+        response = self.http.request(
+            'GET', url, headers=ResponseCache.conditional_headers(cached))
+        with self.stats_lock:
+            self.fetch_count += 1
+            self.fetch_bytes += len(response.data)
+        if cached and response.status == 304:
+            self.cache.touch(url, revalidated=True)
+            with self.stats_lock:
+                self.cache_hit_count += 1
+            return cached
+        if self.cache and response.status == 200:
+            self.cache.set(url, response.data, response.headers)
+        return response
+
+    def map_pages(self, url_list, parser):
+        """
+        url_listのページを並行して取得し、parserで解析した結果をurl_listの順に返す
+        :param url_list: list
+        :param parser: レスポンスを受け取る関数
+        :return list:
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(
+                lambda url: parser(self.get_html_from(url)), url_list))
+
+    def report(self):
+        return '{}ページを取得しました。(合計{:,}バイト、キャッシュ利用{}ページ)'.format(
+            self.fetch_count, self.fetch_bytes, self.cache_hit_count)
+
+    def extra_drama_part1_data_from(self, response):
+        """
+        名前、あらすじ、画像URL、スタッフ情報、キャスト情報を取得するメソッド
+        :return list:
+            [dict, dict, ...., dict]
+        """
+        soup = BeautifulSoup(response.data, 'lxml')
+        url_list = self.extra_drama_part1_url(soup)
+        next_page_path = soup.select_one('ul.pageNav > li.nextPage > a')['href']
+        next_page_url = self.create_url(next_page_path, drama_default1=True)
+        next_response = self.get_html_from(next_page_url)
+        next_soup = BeautifulSoup(next_response.data, 'lxml')
+        url_list_of_next_page = self.extra_drama_part1_url(next_soup)
+        url_list.extend(url_list_of_next_page)
+        return self.map_pages(url_list, self.extra_drama_part1_detail_data_from)
+
+    @staticmethod
+    def extra_drama_part1_detail_data_from(response):
+        """
+        :return dict:
+          {name: (text), description: (text), img_url: (text),
+          cast: list[role, name], staff: list[role, name]}
+        """
+        detail_soup = BeautifulSoup(response.data, 'lxml')
+        name = detail_soup.select_one(
+            '#top > div.cp_cont__h > div > div.pp_prg_hdr__grid_1_1 > h1 >'
+            ' span.pp_prg_name__ttl').text.replace('\u3000', '')
+        description = detail_soup.select_one(
+            '#top > div.cp_cont__b > div.pp_prg_data > '
+            'div.pp_prg_data__grid_1_1 > p.pp_prg_plot').text
+        img_url_data = detail_soup.select_one(
+            '#top > div.cp_cont__b > div.pp_prg_data >'
+            ' div.pp_prg_data__grid_1_2 > img')
+        cast_data = detail_soup.find_all('div', class_="cp_cast__txt")
+        cast_list = []
+        pattern = r'役'
+        repatter = re.compile(pattern)
+        for cast_tag in cast_data:
+            cast_name_data = cast_tag.find('span', class_="cp_cast__name")
+            cast_role_data = cast_tag.find('p', class_="cp_cast__char")
+            if cast_name_data and cast_role_data:
+                cast_role = cast_role_data.text
+                if repatter.search(cast_role):
+                    cast_role = cast_role[:-1]
+                cast_list.append('{}:{}'.format(cast_role, cast_name_data.text))
+        staff_data = detail_soup.find_all('li', class_="cp_stf_ls__i")
+        staff_list = []
+        for staff_tag in staff_data:
+            staff_name_data = staff_tag.find('span', class_="cp_stf__n")
+            staff_role_data = staff_tag.find('span', class_="cp_stf__r")
+            if staff_name_data and staff_role_data:
+                staff_list.append('{}:{}'.format(
+                    staff_role_data.text, staff_name_data.text))
+        contents_dict = {'name': name, 'description': description}
+        if img_url_data:
+            contents_dict['img_url'] = img_url_data['src']
+        if cast_list:
+            contents_dict['cast'] = cast_list
+        if staff_list:
+            contents_dict['staff'] = staff_list
+        return contents_dict
+
+    def extra_drama_part1_url(self, soup):
+        url_list = []
+        contents_boxes = soup.select(
+            'div.contentBody.programContent.cn_prg_selections > '
+            'ul.listContent.programList > li.listItem.largeItem')
+        for box in contents_boxes:
+            a_tag = box.find('a')
+            if a_tag:
+                url_path = a_tag['href']
+                url = self.create_url(url_path, drama_default1=True)
+                url_list.append(url)
+        return url_list
+
+    def extra_drama_part2_data_from(self, response):
+        """
+        作品名、公式URL、screen_name、放送開始日を取得するメソッド
+        :return list: ここで取得したcontent情報のリスト
+            [dict, dict, ..., dict]
+        """
+        soup = BeautifulSoup(response.data, 'lxml')
+        drama_boxes = soup.select(
+            '#new-season > #season-drama > .day-dramas > ul')
+        url_list = []
+        if drama_boxes:
+            for item in drama_boxes:
+                a_tag = item.find('a')
+                if a_tag:
+                    url_list.append(a_tag['href'])
+        return self.map_pages(url_list, self.extra_drama_detail_part2_data_from)
+
+    @staticmethod
+    def extra_drama_detail_part2_data_from(response):
+        """
+        :return: dict
+            {name: (text), official_url: (text), screen_name: (text),
+            release_date: (time_date), maker: (text)}
+        """
+        soup = BeautifulSoup(response.data, 'lxml')
+        all_info = soup.find_all('ul', class_='square')
+        basic_info = all_info[0].find_all('li')
+        content_dict = {}
+        pattern = r'https://twitter.com/(\w+)(\?\w+=\w+)?'
+        repatter = re.compile(pattern)
+        for li in basic_info:
+            if 'タイトル：' in li.text:
+                content_dict['name'] = re.split('：', li.text)[1]
+            if 'ドラマ公式URL' in li.text:
+                content_dict['official_url'] = li.find('a')['href']
+            if 'ドラマ公式Twitter' in li.text:
+                screen_name_data = repatter.match(li.find('a')['href'])
+                content_dict['screen_name'] = screen_name_data.groups()[0]
+            if '放映日時' in li.text:
+                date_and_time = re.split(' ', li.text)[1]
+                if '放送開始日' in li.text:
+                    year_and_month = re.split('：', li.text)[1]
+                    release_time_date = year_and_month + " " + date_and_time
+                    native_date = datetime.strptime(release_time_date,
+                                                    '%Y年%m月%d日 %H:%M')
+                    content_dict['release_date'] = timezone(
+                        'Asia/Tokyo').localize(native_date)
+        maker_info = all_info[-1]
+        maker_text = maker_info.find_all('li')[-1].text
+        content_dict['maker'] = re.split('：', maker_text)[1]
+        return content_dict
+
+    def combine(self, contents_list1, contents_list2):
+        combined_list = []
+        for part2 in contents_list2:
+            for part1 in contents_list1:
+                if part1['name'].startswith(part2['name']):
+                    part1.update(part2)
+                    combined_list.append(part1)
+        return combined_list
+
+    def extra_anime_data_from(self, response):
+        """
+        一覧ページから作品ごとの詳細ページと公式サイトを並行して取得する
+        :return self.contents_data (list):
+            [dict, dict, ... dict]
+
+            ＊dictの内容
+            {name: (text), maker: (text), description: (text),
+            cast: list[(text)], official_url: (text), staff: list[(text)],
+            img_url: (text), screen_name: (text)}
+        """
+        soup = BeautifulSoup(response.data, 'lxml')
+        anime_boxes = soup.find_all('div', {'class': 'animeSeasonBox'})
+        if anime_boxes:
+            box_list = []
+            for box in anime_boxes:
+                p_tag = box.find('p', 'seasonAnimeTtl')
+                content_dict = {'name': p_tag.text}
+                detail_url = p_tag.find('a')['href']
+                maker_tag = box.select('dt:contains("制作会社") ~ dd')
+                if maker_tag:
+                    content_dict['maker'] = maker_tag[0].text
+                url = self.create_url(detail_url, anime_default=True)
+                box_list.append((content_dict, url))
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                self.contents_data.extend(executor.map(
+                    lambda box_data: self.extra_anime_detail_data_from(
+                        *box_data), box_list))
+        return self.contents_data
+
+    def extra_anime_detail_data_from(self, content_dict, url):
+        """
+        詳細ページと公式サイトから情報を取得してcontent_dictに追加する
+        :param content_dict: dict 一覧ページから取得した情報
+        :param url: str 詳細ページのURL
+        :return dict: content_dict
+        """
+        html_data = self.get_html_from(url)
+        soup = BeautifulSoup(html_data.data, 'lxml')
+        description_data = soup.select_one('#detailSynopsis > dd')
+        cast_data = soup.select_one(
+            '#detailCast > dd > ul:nth-child(1)')
+        official_url = soup.select_one('#detailLink > dd > ul > li > a')
+        staff = soup.select_one('#detailStaff > dd')
+        img_data = soup.select_one(
+            '#main > div:nth-child(1) > div.articleInner > div > div'
+            '> div.animeDetailBox.clearfix > div.animeDetailImg > img')
+        screen_name = self.get_screen_name_from(official_url.text)
+        if description_data:
+            content_dict['description'] = description_data.text
+        if cast_data:
+            cast = [person.text for person in cast_data.find_all('li')]
+            content_dict['cast'] = cast
+        content_dict['official_url'] = official_url.text
+        if staff:
+            staff_list = [item.text for item in staff.find_all('li')]
+            content_dict['staff'] = staff_list
+        if img_data:
+            if img_data['src'] in EXCLUSION_ANIME_IMG:
+                content_dict['img_url'] = None
+            else:
+                content_dict['img_url'] = img_data['src']
+        if screen_name:
+            content_dict['screen_name'] = screen_name
+        return content_dict
+
+    def get_screen_name_from(self, url):
+        """
+        引数のURLのサイトからtwitterのIDを抜き取り返す
+        :param url:
+        :return　str: screen_name
+        """
+        response = self.get_html_from(url)
+        soup = BeautifulSoup(response.data, 'lxml')
+        pattern = r'https://twitter.com/(\w+)(\?\w+=\w+)?'
+        repatter = re.compile(pattern)
+        a_tag_list = soup.find_all('a', {'href': repatter})
+        screen_name = None
+        if a_tag_list:
+            extract_a_tag_list = [
+                repatter.match(attr['href']).groups()[0].lower() for attr in
+                a_tag_list]
+            correct_a_tag = []
+            for word in extract_a_tag_list:
+                if word not in EXCLUSION_LIST:
+                    correct_a_tag.append(word)
+            if correct_a_tag:
+                screen_name = Counter(correct_a_tag).most_common()[0][0]
+        return screen_name
+
+    # TODO (3) 取得できなかった情報について、release_dateについて
+    @transaction.atomic
+    def store_contents_data(self, category, anime=False, drama=False):
+        """
+        引数のデータをcontentモデル・staffモデルとして保存する。
+        :param category: obj
+        :param anime: Boolean
+        :param drama: Boolean
+        """
+        if self.contents_data:
+            for content_data in self.contents_data:
+                fields_list = ['name', 'description', 'maker', 'screen_name',
+                               'img_url']
+                content_args = {'category': category}
+                for attr_key, attr_value in content_data.items():
+                    if attr_key in fields_list:
+                        content_args[attr_key] = attr_value
+                new_content = Content.objects.create(**content_args)
+                self.contents.append(new_content)
+                if anime:
+                    self.store_anime_staff(content_data, new_content)
+                if drama:
+                    self.store_drama_staff(content_data, new_content)
+
+    @staticmethod
+    def store_anime_staff(content_dict, content):
+        """
+        :param content_dict: 取得したコンテンツのdict
+        :param content: スタッフ情報を保存するコンテンツ
+        """
+        if 'staff' in content_dict:
+            role_and_name = [re.split('[【】、]', person)
+                             for person in content_dict['staff']]
+            for item in role_and_name:
+                staff_args = {'name': item[2], 'role': item[1],
+                              'content': content}
+                Staff.objects.create(**staff_args)
+                limit = len(item) - 3
+                for num in range(limit):
+                    staff_args = {'role': item[1],
+                                  'name': item[num + 3],
+                                  'content': content}
+                    Staff.objects.create(**staff_args)
+        if 'cast' in content_dict:
+            role_and_name = [
+                person.split('：') for person in content_dict['cast']]
+            for person in role_and_name:
+                staff_args = {'role': person[0], 'name': person[1],
+                              'content': content, 'is_cast': True}
+                Staff.objects.create(**staff_args)
+
+    @staticmethod
+    def store_drama_staff(content_dict, content):
+        if 'staff' in content_dict:
+            role_and_name = [re.split(':', person)
+                             for person in content_dict['staff']]
+            for person in role_and_name:
+                staff_args = {'name': person[1], 'role': person[0],
+                              'content': content}
+                Staff.objects.create(**staff_args)
+        if 'cast' in content_dict:
+            role_and_name = [
+                person.split(':') for person in content_dict['cast']]
+            for person in role_and_name:
+                staff_args = {'name': person[1], 'role': person[0],
+                              'content': content, 'is_cast': True}
+                Staff.objects.create(**staff_args)
+
+    @transaction.atomic
+    def get_anime_data(self):
+        """
+        アニメに関する情報を取得しモデルを新規作成する
+        :return: list 取得したデータ
+        """
+        url = self.create_url('/program', anime_default=True)
+        response = self.get_html_from(url)
+        self.extra_anime_data_from(response)
+        anime_category = Category.objects.get(name='アニメ')
+        self.store_contents_data(anime_category, anime=True)
+        return self
+
+    @transaction.atomic
+    def get_drama_data(self):
+        """
+        ドラマに関する情報を取得しモデルを作成する
+        :return:
+        """
+        url = self.create_url(DRAMA_PART1_PATH, drama_default1=True)
+        response_part1 = self.get_html_from(url)
+        part1_contents_list = self.extra_drama_part1_data_from(response_part1)
+        response_part2 = self.get_html_from(DRAMA_PART2_DOMAIN)
+        part2_contents_list = self.extra_drama_part2_data_from(response_part2)
+        self.contents_data = self.combine(
+            part1_contents_list, part2_contents_list)
+        drama_category = Category.objects.get(name='ドラマ')
+        self.store_contents_data(drama_category, drama=True)
+        return self
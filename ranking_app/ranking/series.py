@@ -0,0 +1,46 @@
+import numpy as np
+
+
+class TweetSeries(object):
+    """
+    ツイートごとの(ツイート日, 最新のリツイート数, 最新のいいね数)をNumPyの配列で持つ。
+    グラフや人気ツイートなど、ツイートの推移を使う集計はこのクラスの配列から計算する。
+    """
+
+    def __init__(self, tweet_pks, tweet_ids, dates, retweets, favorites):
+        self.tweet_pks = tweet_pks
+        self.tweet_ids = tweet_ids
+        self.dates = dates
+        self.retweets = retweets
+        self.favorites = favorites
+
+    def __len__(self):
+        return len(self.tweet_pks)
+
+    @classmethod
+    def from_queryset(cls, tweets):
+        """
+        ツイートのquerysetから、最新のTweetCountも含めて１回のクエリで配列を作る
+        :param tweets: Tweetのqueryset
+        :return TweetSeries:
+        """
+        rows = list(tweets.with_latest_counts().order_by(
+            'tweet_date', 'pk').values_list(
+            'pk', 'tweet_id', 'tweet_date', 'latest_retweet_count',
+            'latest_favorite_count'))
+        tweet_pks, tweet_ids, dates, retweets, favorites = (
+            zip(*rows) if rows else ([], [], [], [], []))
+        return cls(np.array(tweet_pks, dtype=np.int64),
+                   np.array(tweet_ids, dtype=object),
+                   np.array(dates, dtype=object),
+                   np.array([count or 0 for count in retweets],
+                            dtype=np.float64),
+                   np.array([count or 0 for count in favorites],
+                            dtype=np.float64))
+
+    def points(self):
+        """
+        TweetCount.appraiseと同じ計算式のポイントをまとめて計算する
+        :return numpy.ndarray:
+        """
+        return np.round((self.favorites + self.retweets * 2) / 100, 2)
@@ -0,0 +1,63 @@
+from datetime import timedelta
+from xml.sax.saxutils import escape
+
+SPARKLINE_WIDTH = 640
+SPARKLINE_HEIGHT = 240
+SPARKLINE_PADDING = 32
+SPARKLINE_TICK_DAYS = 5
+SPARKLINE_COLOR = '#1f77b4'
+
+
+def sparkline_svg(dates, points, start, end,
+                  width=SPARKLINE_WIDTH, height=SPARKLINE_HEIGHT):
+    """
+    matplotlibを使わずにポイント推移の折れ線グラフをSVGで作る
+    :param dates: list ツイート日
+    :param points: list ツイートごとのポイント
+    :param start: datetime グラフの開始日
+    :param end: datetime グラフの終了日
+    :return bytes: SVG
+    """
+    left, top = SPARKLINE_PADDING, SPARKLINE_PADDING // 2
+    right, bottom = width - SPARKLINE_PADDING // 2, height - SPARKLINE_PADDING
+    span = max((end - start).total_seconds(), 1)
+    max_point = max([float(point) for point in points] + [0]) or 1
+
+    def x_of(date):
+        return left + (right - left) * (date - start).total_seconds() / span
+
+    def y_of(point):
+        return bottom - (bottom - top) * float(point) / max_point
+
+    elements = [
+        '<line x1="{0}" y1="{1}" x2="{2}" y2="{1}" stroke="#000"/>'.format(
+            left, bottom, right),
+        '<line x1="{0}" y1="{1}" x2="{0}" y2="{2}" stroke="#000"/>'.format(
+            left, top, bottom),
+        '<text x="{}" y="{}" text-anchor="end">{:g}</text>'.format(
+            left - 4, top + 4, max_point),
+        '<text x="{}" y="{}" text-anchor="end">0</text>'.format(
+            left - 4, bottom),
+    ]
+    tick = start
+    while tick <= end:
+        x = round(x_of(tick), 1)
+        elements.append(
+            '<line x1="{0}" y1="{1}" x2="{0}" y2="{2}" stroke="#000"/>'.format(
+                x, bottom, bottom + 4))
+        elements.append(
+            '<text x="{}" y="{}" text-anchor="middle">{}</text>'.format(
+                x, bottom + 16, escape(tick.strftime('%m/%d'))))
+        tick += timedelta(days=SPARKLINE_TICK_DAYS)
+    coordinates = ' '.join(
+        '{:.1f},{:.1f}'.format(x_of(date), y_of(point))
+        for date, point in zip(dates, points))
+    if coordinates:
+        elements.append(
+            '<polyline points="{}" fill="none" stroke="{}" '
+            'stroke-width="1.5"/>'.format(coordinates, SPARKLINE_COLOR))
+    svg = (
+        '<svg xmlns="http://www.w3.org/2000/svg" width="{0}" height="{1}" '
+        'viewBox="0 0 {0} {1}" font-family="sans-serif" font-size="10">'
+        '{2}</svg>').format(width, height, ''.join(elements))
+    return svg.encode('utf-8')
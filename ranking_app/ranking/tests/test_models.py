@@ -1,17 +1,46 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from datetime import timedelta
+import json
+import os
 from pytz import timezone
+import tempfile
+import time
 from unittest import mock
 
+from django.contrib import admin
 from django.db.utils import IntegrityError
 from django.db.utils import DataError
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from ranking import factory
+from ranking.admin import ContentAdmin
+from ranking.compaction import compact_tweet_counts
+from ranking.compaction import iter_tweet_chunks
+from ranking.compaction import snapshots_to_delete
+from ranking.management.commands.scraping import Command as ScrapingCommand
+from ranking.mock import create_tweets
 from ranking.mock import response_data_mock
+from ranking.graph import Graph
+from ranking.models import Category
 from ranking.models import Content
-from ranking.models import ScrapingContent
-from ranking.models import TwitterApi
+from ranking.models import FetchFailure
+from ranking.models import Ranking
+from ranking.models import SyncCursor
+from ranking.models import TweetCount
 from ranking.models import TwitterUser
+from ranking.scraping import HostThrottle
+from ranking.scraping import ResponseCache
+from ranking.scraping import ScrapingCacheMiss
+from ranking.scraping import ScrapingContent
+from ranking.twitter import API_MAX_RETRIES
+from ranking.twitter import EndpointBudget
+from ranking.twitter import TwitterApi
+from ranking.twitter import TwitterApiError
+from ranking.twitter import TwitterFetcher
+from ranking.twitter import prefetch_pages
 
 # Create your tests here.
 
@@ -92,6 +121,31 @@ class ContentModelTests(TestCase):
         self.assertNotIn(dorama_content, sort_contents)
         self.assertEqual(low_content, sort_contents[-1])
 
+    def test_with_points(self):
+        category = factory.CategoryFactory(name='アニメ')
+        for retweet in [0, 3, 10, 100]:
+            self.create_content_twitter_tweet_tweetcount(category,
+                                                         retweet=retweet)
+        factory.ContentFactory(category=category)
+
+        contents = Content.objects.with_points()
+        self.assertEqual(contents.count(), 5)
+        for content in contents:
+            self.assertAlmostEqual(content.points, content.appraise())
+
+    def test_sort_twitter_rating_by_single_query(self):
+        category = factory.CategoryFactory(name='アニメ')
+        for retweet in range(10):
+            self.create_content_twitter_tweet_tweetcount(category,
+                                                         retweet=retweet)
+
+        with self.assertNumQueries(1):
+            sort_info = Content.sort_twitter_rating_by(category)
+        points = [info['points'] for info in sort_info]
+        self.assertEqual(points, sorted(points, reverse=True))
+        self.assertEqual([info['rank'] for info in sort_info],
+                         list(range(1, 11)))
+
     @staticmethod
     def create_content_twitter_tweet_tweetcount(category, retweet=10):
         content = factory.ContentFactory(category=category)
@@ -104,12 +158,73 @@ class ContentModelTests(TestCase):
         return content
 
 
+class RankingModelTests(TestCase):
+
+    def test_refresh(self):
+        anime_category = factory.CategoryFactory(name='アニメ')
+        dorama_category = factory.CategoryFactory(name='ドラマ')
+        content = ContentModelTests.create_content_twitter_tweet_tweetcount(
+            anime_category, retweet=100)
+        low_content = ContentModelTests.create_content_twitter_tweet_tweetcount(
+            anime_category, retweet=10)
+        dorama_content = ContentModelTests.create_content_twitter_tweet_tweetcount(
+            dorama_category)
+
+        Ranking.refresh(anime_category)
+
+        ranking = list(anime_category.ranking_set.all())
+        self.assertEqual([content, low_content],
+                         [info.content for info in ranking])
+        self.assertEqual([1, 2], [info.rank for info in ranking])
+        self.assertEqual(ranking[0].points, content.appraise())
+        self.assertEqual(content.rank(), 1)
+        self.assertEqual(low_content.rank(), 2)
+        self.assertFalse(Ranking.objects.filter(content=dorama_content).exists())
+
+    def test_rank_bounded_queries(self):
+        anime_category = factory.CategoryFactory(name='アニメ')
+        contents = [
+            ContentModelTests.create_content_twitter_tweet_tweetcount(
+                anime_category, retweet=retweet) for retweet in range(20)]
+        Ranking.refresh(anime_category)
+
+        for content in [contents[0], contents[-1]]:
+            content = Content.objects.get(pk=content.pk)
+            with self.assertNumQueries(1):
+                content.rank()
+
+    def test_rank_without_ranking(self):
+        anime_category = factory.CategoryFactory(name='アニメ')
+        contents = [
+            ContentModelTests.create_content_twitter_tweet_tweetcount(
+                anime_category, retweet=retweet) for retweet in range(5)]
+
+        for expected_rank, content in enumerate(reversed(contents), 1):
+            content = Content.objects.get(pk=content.pk)
+            with self.assertNumQueries(3):
+                self.assertEqual(content.rank(), expected_rank)
+
+    def test_refresh_replaces_previous_ranking(self):
+        anime_category = factory.CategoryFactory(name='アニメ')
+        content = ContentModelTests.create_content_twitter_tweet_tweetcount(
+            anime_category, retweet=10)
+        Ranking.refresh(anime_category)
+        high_content = ContentModelTests.create_content_twitter_tweet_tweetcount(
+            anime_category, retweet=100)
+
+        Ranking.refresh(anime_category)
+
+        self.assertEqual(anime_category.ranking_set.count(), 2)
+        self.assertEqual(Content.objects.get(pk=high_content.pk).rank(), 1)
+        self.assertEqual(Content.objects.get(pk=content.pk).rank(), 2)
+
+
 class CategoryModelTests(TestCase):
 
     def test_name_unique(self):
-        factory.CategoryFactory(name='Movie')
+        Category.objects.create(name='Movie')
         with self.assertRaises(IntegrityError):
-            factory.CategoryFactory(name='Movie')
+            Category.objects.create(name='Movie')
 
     def test_name_max_length(self):
         name = 'a' * 51
@@ -157,6 +272,128 @@ class TwitterUserModelTests(TestCase):
         self.twitter_user.loads_tweet()
         self.assertEqual(self.twitter_user.favorite_avg(), 5)
 
+    def test_loads_tweet_single_query(self):
+        for num in range(10):
+            tweet = factory.TweetFactory(tweet_id=str(num),
+                                         twitter_user=self.twitter_user)
+            factory.TweetCountFactory(tweet=tweet, retweet_count=1,
+                                      favorite_count=1)
+            factory.TweetCountFactory(tweet=tweet, retweet_count=10,
+                                      favorite_count=5)
+
+        with self.assertNumQueries(2):
+            self.twitter_user.loads_tweet()
+        self.assertEqual(self.twitter_user.all_tweet_count, 10)
+        self.assertEqual(self.twitter_user.all_retweet_count, 100)
+        self.assertEqual(self.twitter_user.all_favorite_count, 50)
+
+    def test_store_timeline_data_adds_only_diff(self):
+        timeline = response_data_mock(
+            'https://api.twitter.com/1.1/statuses/user_timeline.json', {})
+        TwitterApi.store_timeline_data(timeline, self.twitter_user)
+        for tweet in timeline[:10]:
+            tweet['retweet_count'] += 5
+            tweet['favorite_count'] += 3
+        updated_timeline = timeline[:10] + response_data_mock(
+            'https://api.twitter.com/1.1/statuses/user_timeline.json',
+            {'max_id': 50})
+
+        TwitterApi.store_timeline_data(updated_timeline, self.twitter_user)
+
+        twitter_user = TwitterUser.objects.get(pk=self.twitter_user.pk)
+        self.assertEqual(twitter_user.all_tweet_count, 100)
+        self.assertEqual(self.twitter_user.all_tweet_count, 100)
+        incremental = (twitter_user.all_tweet_count,
+                       twitter_user.all_retweet_count,
+                       twitter_user.all_favorite_count)
+        twitter_user.loads_tweet()
+        self.assertEqual(incremental, (twitter_user.all_tweet_count,
+                                       twitter_user.all_retweet_count,
+                                       twitter_user.all_favorite_count))
+
+    def test_store_timeline_data_in_batches(self):
+        timeline = response_data_mock(
+            'https://api.twitter.com/1.1/statuses/user_timeline.json', {})
+        timeline += response_data_mock(
+            'https://api.twitter.com/1.1/statuses/user_timeline.json',
+            {'max_id': 50})
+
+        with CaptureQueriesContext(connection) as queries:
+            TwitterApi.store_timeline_data(timeline, self.twitter_user,
+                                           batch_size=30)
+
+        self.assertLess(len(queries), 30)
+        self.assertEqual(self.twitter_user.tweet_set.count(), 100)
+        self.assertEqual(
+            TweetCount.objects.filter(
+                tweet__twitter_user=self.twitter_user).count(), 100)
+        self.assertEqual(self.twitter_user.all_retweet_count,
+                         sum(tweet['retweet_count'] for tweet in timeline))
+
+    def test_store_timeline_data_skips_unchanged_counts(self):
+        timeline = response_data_mock(
+            'https://api.twitter.com/1.1/statuses/user_timeline.json', {})
+        TwitterApi.store_timeline_data(timeline, self.twitter_user)
+        timeline[0]['retweet_count'] += 1
+
+        TwitterApi.store_timeline_data(timeline, self.twitter_user)
+
+        counts = TweetCount.objects.filter(
+            tweet__twitter_user=self.twitter_user)
+        self.assertEqual(counts.count(), len(timeline) + 1)
+        self.assertEqual(
+            counts.filter(tweet__tweet_id=timeline[0]['id_str']).count(), 2)
+
+    def test_admin_shows_last_sync_at(self):
+        content_admin = ContentAdmin(Content, admin.site)
+        content = self.twitter_user.content
+        self.assertEqual(content_admin.last_sync_at(content), '未取得')
+        timeline = response_data_mock(
+            'https://api.twitter.com/1.1/statuses/user_timeline.json', {})
+
+        TwitterApi.store_timeline_pages([timeline, timeline],
+                                        self.twitter_user)
+
+        self.assertNotEqual(content_admin.last_sync_at(content), '未取得')
+
+    def test_tweet_series(self):
+        ja_tz = timezone('Asia/Tokyo')
+        for num in range(5):
+            tweet = factory.TweetFactory(
+                tweet_id=str(num), twitter_user=self.twitter_user,
+                tweet_date=datetime(2020, 4, num + 1, tzinfo=ja_tz))
+            factory.TweetCountFactory(tweet=tweet, retweet_count=1,
+                                      favorite_count=1)
+            factory.TweetCountFactory(tweet=tweet, retweet_count=num * 10,
+                                      favorite_count=num * 20)
+
+        with self.assertNumQueries(1):
+            series = self.twitter_user.tweet_series(
+                start=datetime(2020, 4, 2, tzinfo=ja_tz),
+                end=datetime(2020, 4, 5, tzinfo=ja_tz))
+
+        self.assertEqual(list(series.tweet_ids), ['1', '2', '3'])
+        self.assertEqual(list(series.retweets), [10, 20, 30])
+        self.assertEqual(list(series.points()), [0.4, 0.8, 1.2])
+
+    def test_popular_tweet(self):
+        ja_tz = timezone('Asia/Tokyo')
+        for num in range(5):
+            tweet = factory.TweetFactory(tweet_id=str(num),
+                                         twitter_user=self.twitter_user,
+                                         tweet_date=datetime.now(ja_tz))
+            factory.TweetCountFactory(tweet=tweet, retweet_count=num,
+                                      favorite_count=num)
+
+        with self.assertNumQueries(2):
+            points, tweet = self.twitter_user.popular_tweet()
+
+        self.assertEqual(tweet.tweet_id, '4')
+        self.assertEqual(points, 0.12)
+
+    def test_popular_tweet_without_tweets(self):
+        self.assertIsNone(self.twitter_user.popular_tweet())
+
     def test_favorite_avg_with_0(self):
         self.assertEqual(self.twitter_user.favorite_avg(), 0)
 
@@ -164,13 +401,71 @@ class TwitterUserModelTests(TestCase):
         self.assertEqual(self.twitter_user.retweets_avg(), 0)
 
 
+class CompactionTests(TestCase):
+
+    def setUp(self):
+        self.now = datetime(2020, 7, 1, 12, tzinfo=timezone('Asia/Tokyo'))
+
+    def snapshot(self, pk, days_ago, hours=0, counts=None):
+        create_date = self.now - timedelta(days=days_ago, hours=hours)
+        return (pk, create_date) + (counts or (pk, pk))
+
+    def test_snapshots_to_delete(self):
+        snapshots = [
+            self.snapshot(1, 200, hours=2),
+            self.snapshot(2, 200),
+            self.snapshot(3, 30, hours=2),
+            self.snapshot(4, 30),
+            self.snapshot(5, 3, hours=2),
+            self.snapshot(6, 3),
+            self.snapshot(7, 0),
+        ]
+
+        self.assertEqual(snapshots_to_delete(snapshots, self.now), [1, 3])
+
+    def test_snapshots_to_delete_unchanged(self):
+        snapshots = [
+            self.snapshot(1, 3, counts=(1, 1)),
+            self.snapshot(2, 2, counts=(1, 1)),
+            self.snapshot(3, 1, counts=(2, 1)),
+            self.snapshot(4, 0, counts=(2, 1)),
+        ]
+
+        self.assertEqual(snapshots_to_delete(snapshots, self.now), [2])
+        self.assertEqual(snapshots_to_delete(snapshots[-1:], self.now), [])
+
+    def test_compact_tweet_counts(self):
+        tweet = factory.TweetFactory()
+        for days_ago in [100, 100, 50, 50, 1, 0]:
+            tweet_count = factory.TweetCountFactory(
+                tweet=tweet, retweet_count=days_ago, favorite_count=days_ago)
+            TweetCount.objects.filter(pk=tweet_count.pk).update(
+                create_date=self.now - timedelta(days=days_ago))
+        latest = tweet.tweetcount_set.latest('create_date')
+
+        self.assertEqual(compact_tweet_counts(
+            [tweet.pk], self.now, dry_run=True), 2)
+        self.assertEqual(tweet.tweetcount_set.count(), 6)
+        self.assertEqual(compact_tweet_counts([tweet.pk], self.now), 2)
+        self.assertEqual(tweet.tweetcount_set.count(), 4)
+        self.assertEqual(tweet.tweetcount_set.latest('create_date'), latest)
+
+    def test_iter_tweet_chunks(self):
+        tweets = [factory.TweetFactory(tweet_id=str(num)) for num in range(5)]
+
+        chunks = list(iter_tweet_chunks(chunk_size=2))
+
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        self.assertEqual(sum(chunks, []), [tweet.pk for tweet in tweets])
+
+
 class TwitterApiModelTests(TestCase):
 
     def setUp(self):
         self.screen_name = 'sample_screen_name'
         self.content = factory.ContentFactory(screen_name=self.screen_name)
 
-    @mock.patch('ranking.models.TwitterApi.get_base')
+    @mock.patch('ranking.twitter.TwitterApi.get_base')
     def test_get_user(self, mock_get_base):
         mock_get_base.side_effect = response_data_mock
 
@@ -178,7 +473,7 @@ class TwitterApiModelTests(TestCase):
 
         mock_get_base.assert_called_once()
 
-    @mock.patch('ranking.models.TwitterApi.get_base')
+    @mock.patch('ranking.twitter.TwitterApi.get_base')
     def test_get_most_timeline_call_three_times(self, mock_get_base):
         mock_get_base.side_effect = response_data_mock
 
@@ -186,7 +481,107 @@ class TwitterApiModelTests(TestCase):
 
         self.assertEqual(mock_get_base.call_count, 3)
 
-    @mock.patch('ranking.models.TwitterApi.get_base')
+    @mock.patch('ranking.twitter.TwitterApi.get_base')
+    def test_iter_timeline_pages(self, mock_get_base):
+        mock_get_base.side_effect = response_data_mock
+
+        pages = list(TwitterApi().iter_timeline_pages('test name'))
+
+        self.assertEqual([len(page) for page in pages], [50, 50])
+        self.assertEqual(pages[1][0]['id'], pages[0][-1]['id'] - 1)
+        self.assertEqual(mock_get_base.call_count, 3)
+
+    def test_store_timeline_pages_while_fetching(self):
+        twitter_user = factory.TwitterUserFactory(content=self.content)
+        stored_counts = []
+
+        def pages():
+            for limit_id in [100, 50]:
+                stored_counts.append(twitter_user.tweet_set.count())
+                yield create_tweets(limit_id)
+
+        TwitterApi.store_timeline_pages(pages(), twitter_user)
+
+        self.assertEqual(stored_counts, [0, 50])
+        self.assertEqual(twitter_user.all_tweet_count, 100)
+
+    @mock.patch('ranking.twitter.TwitterApi.get_base')
+    def test_iter_timeline_pages_stops_at_stored_tweet(self, mock_get_base):
+        mock_get_base.side_effect = response_data_mock
+
+        pages = list(TwitterApi().iter_timeline_pages(
+            'test name', since_id=59, stop_id=60))
+
+        self.assertEqual(len(pages), 1)
+        mock_get_base.assert_called_once()
+
+    def test_sync_window_without_tweets(self):
+        twitter_user = factory.TwitterUserFactory(content=self.content)
+
+        self.assertEqual(TwitterApi.sync_window(twitter_user), (None, None))
+
+    def test_sync_window_from_oldest_active_tweet(self):
+        twitter_user = factory.TwitterUserFactory(content=self.content)
+        now = datetime.now(timezone('Asia/Tokyo'))
+        for tweet_id, days in [(10, 30), (20, 3), (30, 1)]:
+            factory.TweetFactory(twitter_user=twitter_user,
+                                 tweet_id=str(tweet_id),
+                                 tweet_date=now - timedelta(days=days))
+        SyncCursor.record(twitter_user, 30)
+
+        self.assertEqual(TwitterApi.sync_window(twitter_user, active_days=7),
+                         (19, 20))
+
+    def test_sync_window_from_cursor(self):
+        twitter_user = factory.TwitterUserFactory(content=self.content)
+        factory.TweetFactory(twitter_user=twitter_user, tweet_id='10',
+                             tweet_date=datetime(2020, 4, 1,
+                                                 tzinfo=timezone('Asia/Tokyo')))
+        SyncCursor.record(twitter_user, 10)
+
+        self.assertEqual(TwitterApi.sync_window(twitter_user), (9, 10))
+
+    def test_store_timeline_pages_records_cursor(self):
+        twitter_user = factory.TwitterUserFactory(content=self.content)
+
+        TwitterApi.store_timeline_pages(
+            [create_tweets(100), create_tweets(50)], twitter_user)
+
+        cursor = SyncCursor.objects.get(twitter_user=twitter_user)
+        self.assertEqual(cursor.newest_id, 100)
+        self.assertIsNotNone(cursor.last_sync_at)
+
+    def test_prefetch_pages(self):
+        pages = [[num] for num in range(10)]
+
+        self.assertEqual(list(prefetch_pages(iter(pages), depth=2)), pages)
+
+    def test_prefetch_pages_raises_error_in_caller(self):
+        def pages():
+            yield [1]
+            raise TwitterApiError('error')
+
+        prefetched = prefetch_pages(pages())
+
+        self.assertEqual(next(prefetched), [1])
+        with self.assertRaises(TwitterApiError):
+            next(prefetched)
+
+    def test_prefetch_pages_stops_producer_on_close(self):
+        fetched = []
+
+        def pages():
+            for num in range(100):
+                fetched.append(num)
+                yield [num]
+
+        prefetched = prefetch_pages(pages(), depth=1)
+        next(prefetched)
+        prefetched.close()
+
+        self.assertLess(len(fetched), 100)
+
+    @mock.patch('ranking.twitter.TwitterApi.get_base')
     def test_get_and_store_twitter_data(self, mock_get_base):
         mock_get_base.side_effect = response_data_mock
 
@@ -201,7 +596,7 @@ class TwitterApiModelTests(TestCase):
         self.assertGreater(twitter_user.all_retweet_count, 0)
         self.assertGreater(twitter_user.all_favorite_count, 0)
 
-    @mock.patch('ranking.models.TwitterApi.get_base')
+    @mock.patch('ranking.twitter.TwitterApi.get_base')
     def test_get_and_store_twitter_data_without_screen_name(self,
                                                             mock_get_base):
         mock_get_base.side_effect = response_data_mock
@@ -211,7 +606,7 @@ class TwitterApiModelTests(TestCase):
 
         mock_get_base.assert_not_called()
 
-    @mock.patch('ranking.models.TwitterApi.get_base')
+    @mock.patch('ranking.twitter.TwitterApi.get_base')
     def test_get_and_store_twitter_data_without_image_url(self, mock_get_base):
         mock_get_base.side_effect = response_data_mock
 
@@ -222,7 +617,7 @@ class TwitterApiModelTests(TestCase):
         self.assertIsNone(twitter_user.icon_url, None)
         self.assertIsNone(twitter_user.banner_url, None)
 
-    @mock.patch('ranking.models.TwitterApi.get_base')
+    @mock.patch('ranking.twitter.TwitterApi.get_base')
     def test_update_data(self, mock_get_base):
         """
         # start_dateよりも古いツイートを取得できないかのテストはまだかけていない
@@ -257,6 +652,287 @@ class TwitterApiModelTests(TestCase):
         self.assertEqual(updated_tweet.tweetcount_set.all().count(), 2)
 
 
+    @mock.patch('ranking.twitter.TwitterApi.get_base')
+    def test_scraping_continues_after_api_error(self, mock_get_base):
+        broken = factory.ContentFactory(screen_name='broken')
+
+        def response(url, query):
+            if query.get('screen_name') == 'broken':
+                raise TwitterApiError('error')
+            return response_data_mock(url, query)
+        mock_get_base.side_effect = response
+
+        with mock.patch('builtins.print'):
+            ScrapingCommand.store_twitter_data([broken, self.content])
+
+        self.assertTrue(self.content.has_tweets())
+        self.assertEqual(
+            FetchFailure.objects.get(content=broken).failure_count, 1)
+
+class TwitterFetcherTests(TestCase):
+
+    def setUp(self):
+        self.category = factory.CategoryFactory(name='アニメ')
+        self.contents, self.id_offsets = [], {}
+        ja_tz = timezone('Asia/Tokyo')
+        for num in range(3):
+            content = factory.ContentFactory(category=self.category)
+            twitter_user = factory.TwitterUserFactory(content=content)
+            offset = num * 1000
+            for tweet_id in range(offset, offset + 50):
+                tweet = factory.TweetFactory(twitter_user=twitter_user,
+                                             tweet_id=str(tweet_id),
+                                             tweet_date=datetime.now(ja_tz))
+                factory.TweetCountFactory(tweet=tweet, retweet_count=10,
+                                          favorite_count=10)
+            twitter_user.loads_tweet()
+            self.contents.append(content)
+            self.id_offsets[content.screen_name] = offset
+
+    def response_per_account_mock(self, url, query):
+        """
+        アカウントごとにツイートIDが重ならないようにresponse_data_mockのIDをずらす
+        """
+        offset = self.id_offsets.get(query.get('screen_name'), 0)
+        query = dict(query)
+        if 'max_id' in query:
+            query['max_id'] -= offset
+        response_data = response_data_mock(url, query)
+        if isinstance(response_data, list):
+            for tweet in response_data:
+                tweet['id'] += offset
+                tweet['id_str'] = str(tweet['id'])
+        return response_data
+
+    @mock.patch('ranking.twitter.TwitterApi.get_base')
+    def test_update_contents(self, mock_get_base):
+        mock_get_base.side_effect = self.response_per_account_mock
+
+        fetcher = TwitterFetcher(workers=3)
+        updated = list(fetcher.update_contents(self.contents))
+
+        self.assertCountEqual(updated, self.contents)
+        # 1アカウントにつきユーザー情報1回、タイムライン3回
+        self.assertEqual(mock_get_base.call_count, 12)
+        for content in self.contents:
+            twitter_user = TwitterUser.objects.get(content=content)
+            # 既存のID 0〜49と取得したID 1〜100を合わせた101件
+            self.assertEqual(twitter_user.tweet_set.count(), 101)
+            self.assertEqual(twitter_user.all_tweet_count, 101)
+
+    @mock.patch('ranking.twitter.TwitterApi.get_base')
+    def test_update_contents_rolls_back_failed_account(self, mock_get_base):
+        failed = self.contents[0]
+
+        def response(url, query):
+            if query.get('screen_name') == failed.screen_name and \
+                    'max_id' in query:
+                raise TwitterApiError('error')
+            return self.response_per_account_mock(url, query)
+        mock_get_base.side_effect = response
+
+        errors = []
+
+        updated = list(TwitterFetcher(workers=2).update_contents(
+            self.contents, on_error=lambda content, e: errors.append(content)))
+
+        self.assertEqual(updated, self.contents[1:])
+        self.assertEqual(errors, [failed])
+        self.assertEqual(
+            TwitterUser.objects.get(content=failed).tweet_set.count(), 50)
+        self.assertFalse(SyncCursor.objects.filter(
+            twitter_user__content=failed).exists())
+        self.assertEqual(FetchFailure.objects.get(
+            content=failed).failure_count, 1)
+
+    @mock.patch('ranking.twitter.TwitterApi.get_base')
+    def test_update_contents_skips_without_screen_name(self, mock_get_base):
+        mock_get_base.side_effect = response_data_mock
+        content = factory.ContentFactory(screen_name=None,
+                                         category=self.category)
+
+        updated = list(TwitterFetcher().update_contents([content]))
+
+        self.assertEqual(updated, [])
+        mock_get_base.assert_not_called()
+
+
+def api_response(data, status_code=200, remaining=None, reset_at=None):
+    headers = {}
+    if remaining is not None:
+        headers = {'x-rate-limit-remaining': str(remaining),
+                   'x-rate-limit-reset': str(int(reset_at))}
+    return mock.Mock(status_code=status_code, headers=headers,
+                     text=json.dumps(data))
+
+
+@mock.patch('ranking.twitter.time.sleep')
+@mock.patch('ranking.twitter.OAuth1Session')
+class RateLimiterTests(TestCase):
+
+    def test_sleep_only_when_budget_exhausted(self, mock_session, mock_sleep):
+        reset_at = time.time() + 100
+        mock_session.return_value.get.side_effect = [
+            api_response({'name': 'a'}, remaining=1, reset_at=reset_at),
+            api_response({'name': 'b'}, remaining=0, reset_at=reset_at),
+            api_response({'name': 'c'}, remaining=899, reset_at=reset_at),
+            api_response([], remaining=899, reset_at=reset_at)]
+        api = TwitterApi()
+
+        api.get_user('sample')
+        api.get_user('sample')
+        mock_sleep.assert_not_called()
+        api.get_simple_timeline('sample')
+        mock_sleep.assert_not_called()
+        api.get_user('sample')
+
+        mock_sleep.assert_called_once()
+        self.assertAlmostEqual(mock_sleep.call_args[0][0], 100, delta=5)
+
+    def test_sleep_without_holding_lock(self, mock_session, mock_sleep):
+        budget = EndpointBudget()
+        budget.update(0, time.time() + 100)
+        mock_sleep.side_effect = lambda seconds: self.assertFalse(
+            budget.lock.locked())
+
+        budget.acquire()
+
+        mock_sleep.assert_called_once()
+        self.assertIsNone(budget.remaining)
+
+    def test_recheck_budget_updated_while_sleeping(self, mock_session,
+                                                   mock_sleep):
+        budget = EndpointBudget()
+        budget.update(0, time.time() + 100)
+        mock_sleep.side_effect = lambda seconds: budget.update(
+            5, time.time() + 900)
+
+        budget.acquire()
+
+        mock_sleep.assert_called_once()
+        self.assertEqual(budget.remaining, 4)
+
+    def test_retry_on_server_error(self, mock_session, mock_sleep):
+        mock_session.return_value.get.side_effect = [
+            api_response({}, status_code=503),
+            api_response({'name': 'sample'})]
+
+        result = TwitterApi().get_user('sample')
+
+        self.assertEqual(result, {'name': 'sample'})
+        self.assertEqual(mock_sleep.call_count, 1)
+
+    def test_raise_after_max_retries(self, mock_session, mock_sleep):
+        mock_session.return_value.get.return_value = api_response(
+            {}, status_code=500)
+
+        with self.assertRaises(TwitterApiError):
+            TwitterApi().get_user('sample')
+        self.assertEqual(mock_session.return_value.get.call_count,
+                         API_MAX_RETRIES + 1)
+
+    def test_raise_on_error_payload(self, mock_session, mock_sleep):
+        mock_session.return_value.get.return_value = api_response(
+            {'errors': [{'code': 50, 'message': 'User not found.'}]},
+            status_code=404)
+
+        with self.assertRaises(TwitterApiError):
+            TwitterApi().get_most_timeline('sample')
+
+    def test_raise_on_non_json_error(self, mock_session, mock_sleep):
+        for status_code, text in [(401, '<html>Unauthorized</html>'),
+                                  (404, '')]:
+            mock_session.return_value.get.return_value = mock.Mock(
+                status_code=status_code, headers={}, text=text)
+
+            with self.assertRaises(TwitterApiError):
+                TwitterApi().get_user('sample')
+
+    def test_get_most_timeline_without_tweets(self, mock_session, mock_sleep):
+        mock_session.return_value.get.return_value = api_response([])
+
+        self.assertEqual(TwitterApi().get_most_timeline('sample'), [])
+
+
+class ResponseCacheTests(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = ResponseCache(self.tmp_dir.name, ttl=60)
+        self.url = 'https://anime.eiga.com/program'
+        self.http = mock.Mock()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_store_and_use_fresh_page(self):
+        self.http.request.return_value = mock.Mock(
+            status=200, data=b'<html>1</html>', headers={'ETag': '"abc"'})
+        scraping = ScrapingContent(http=self.http, cache=self.cache)
+
+        scraping.get_html_from(self.url)
+        response = scraping.get_html_from(self.url)
+
+        self.assertEqual(response.data, b'<html>1</html>')
+        self.assertEqual(self.http.request.call_count, 1)
+        self.assertEqual(scraping.cache_hit_count, 1)
+
+    def test_revalidate_stale_page(self):
+        self.cache.set(self.url, b'<html>1</html>',
+                       {'ETag': '"abc"', 'Last-Modified': 'Mon, 01 Jun 2020'})
+        self.cache.ttl = 0
+        self.http.request.return_value = mock.Mock(status=304, data=b'',
+                                                   headers={})
+        scraping = ScrapingContent(http=self.http, cache=self.cache)
+
+        response = scraping.get_html_from(self.url)
+
+        self.assertEqual(response.data, b'<html>1</html>')
+        self.http.request.assert_called_once_with(
+            'GET', self.url, headers={'If-None-Match': '"abc"',
+                                      'If-Modified-Since': 'Mon, 01 Jun 2020'})
+
+    def test_offline_replay(self):
+        self.cache.set(self.url, b'<html>1</html>', {})
+        self.cache.ttl = 0
+        scraping = ScrapingContent(http=self.http, cache=self.cache,
+                                   offline=True)
+
+        self.assertEqual(scraping.get_html_from(self.url).data,
+                         b'<html>1</html>')
+        with self.assertRaises(ScrapingCacheMiss):
+            scraping.get_html_from('https://thetv.jp/')
+        self.http.request.assert_not_called()
+
+    def test_evict_least_recently_used(self):
+        self.cache.max_bytes = 14
+        self.cache.set('https://example.com/1', b'12345', {})
+        self.cache.set('https://example.com/2', b'12345', {})
+        old_time = time.time() - 100
+        os.utime(self.cache.path('https://example.com/1', 'body'),
+                 (old_time, old_time))
+        os.utime(self.cache.path('https://example.com/2', 'body'),
+                 (old_time - 10, old_time - 10))
+        self.cache.touch('https://example.com/2')
+
+        self.cache.set('https://example.com/3', b'12345', {})
+
+        self.assertIsNone(self.cache.get('https://example.com/1'))
+        self.assertIsNotNone(self.cache.get('https://example.com/2'))
+        self.assertIsNotNone(self.cache.get('https://example.com/3'))
+
+
+    def test_scan_only_when_over_limit(self):
+        self.cache.max_bytes = 14
+        self.cache.set('https://example.com/1', b'12345', {})
+
+        with mock.patch('ranking.scraping.os.scandir') as mock_scandir:
+            self.cache.set('https://example.com/1', b'123', {})
+            self.cache.set('https://example.com/2', b'12345', {})
+
+        mock_scandir.assert_not_called()
+        self.assertEqual(self.cache.total_bytes, 8)
+
 class WebScrapingModelTests(TestCase):
     @staticmethod
     def get_anime_data(category):
@@ -276,7 +952,70 @@ class WebScrapingModelTests(TestCase):
         scraping.contents_data = scraping.combine('test', 'test')
         scraping.store_contents_data(category, drama=True)
 
-    @mock.patch('ranking.models.ScrapingContent.combine')
+    def test_share_pool_manager(self):
+        self.assertIs(ScrapingContent().http, ScrapingContent().http)
+
+    def test_get_html_from_counts_fetch(self):
+        http = mock.Mock()
+        http.request.return_value = mock.Mock(data=b'<html></html>')
+        scraping = ScrapingContent(http=http)
+
+        scraping.get_html_from('https://anime.eiga.com/program')
+        scraping.get_html_from('https://anime.eiga.com/program/1')
+
+        self.assertEqual(http.request.call_count, 2)
+        self.assertEqual(scraping.fetch_count, 2)
+        self.assertEqual(scraping.fetch_bytes, 26)
+        self.assertIn('2ページ', scraping.report())
+
+    def test_extra_anime_data_from(self):
+        listing = """
+        <div class="animeSeasonBox">
+          <p class="seasonAnimeTtl"><a href="/program/1/">アニメA</a></p>
+          <dl><dt>制作会社</dt><dd>A制作会社</dd></dl>
+        </div>
+        <div class="animeSeasonBox">
+          <p class="seasonAnimeTtl"><a href="/program/2/">アニメB</a></p>
+        </div>"""
+        detail = """
+        <dl id="detailSynopsis"><dt>あらすじ</dt><dd>あらすじ{num}</dd></dl>
+        <dl id="detailCast"><dt>キャスト</dt><dd><ul><li>主人公：田中</li></ul></dd></dl>
+        <dl id="detailLink"><dt>リンク</dt><dd><ul><li>
+          <a href="https://anime{num}.example.com/">https://anime{num}.example.com/</a>
+        </li></ul></dd></dl>"""
+        official = '<a href="https://twitter.com/anime{num}_pr">twitter</a>'
+        pages = {
+            'https://anime.eiga.com/program/1/': detail.format(num=1),
+            'https://anime.eiga.com/program/2/': detail.format(num=2),
+            'https://anime1.example.com/': official.format(num=1),
+            'https://anime2.example.com/': official.format(num=2)}
+        http = mock.Mock()
+        http.request.side_effect = lambda method, url, headers: mock.Mock(
+            data=pages[url].encode())
+        scraping = ScrapingContent(http=http, host_delay=0)
+
+        contents_data = scraping.extra_anime_data_from(
+            mock.Mock(data=listing.encode()))
+
+        self.assertEqual([data['name'] for data in contents_data],
+                         ['アニメA', 'アニメB'])
+        self.assertEqual(contents_data[0]['maker'], 'A制作会社')
+        self.assertEqual(contents_data[1]['description'], 'あらすじ2')
+        self.assertEqual(contents_data[0]['cast'], ['主人公：田中'])
+        self.assertEqual([data['screen_name'] for data in contents_data],
+                         ['anime1_pr', 'anime2_pr'])
+        self.assertEqual(scraping.fetch_count, 4)
+
+    def test_host_throttle(self):
+        throttle = HostThrottle(delay=0.1)
+        start = time.monotonic()
+        throttle.wait('https://anime.eiga.com/program/1/')
+        throttle.wait('https://thetv.jp/program/1/')
+        self.assertLess(time.monotonic() - start, 0.1)
+        throttle.wait('https://anime.eiga.com/program/2/')
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+
+    @mock.patch('ranking.scraping.ScrapingContent.combine')
     def test_store_drama_data(self, mock_combine):
         test_data = [
             {'name': 'サンプルドラマ',
@@ -300,7 +1039,7 @@ class WebScrapingModelTests(TestCase):
         self.assertEqual(content.performers().count(), 2)
         self.assertEqual(content.only_staff().count(), 3)
 
-    @mock.patch('ranking.models.ScrapingContent.extra_anime_data_from')
+    @mock.patch('ranking.scraping.ScrapingContent.extra_anime_data_from')
     def test_store_anime_data(self, mock_contents_data):
         test_data = [
             {'name': 'サンプルアニメ',
@@ -323,7 +1062,7 @@ class WebScrapingModelTests(TestCase):
         self.assertEqual(content.category, category)
         self.assertEqual(content.staff_set.all().count(), 5)
 
-    @mock.patch('ranking.models.ScrapingContent.extra_anime_data_from')
+    @mock.patch('ranking.scraping.ScrapingContent.extra_anime_data_from')
     def test_store_contents_data_with_little_data(self, mock_contents_data):
         little_data = [{'name': 'サンプルドラマ'}]
         mock_contents_data.return_value = little_data
@@ -338,7 +1077,7 @@ class WebScrapingModelTests(TestCase):
         self.assertEqual(content.category, category)
         self.assertEqual(content.staff_set.all().count(), 0)
 
-    @mock.patch('ranking.models.ScrapingContent.extra_anime_data_from')
+    @mock.patch('ranking.scraping.ScrapingContent.extra_anime_data_from')
     def test_store_contents_data_without_data(self, mock_contents_data):
         mock_contents_data.return_value = []
 
@@ -346,3 +1085,29 @@ class WebScrapingModelTests(TestCase):
         self.get_anime_data(category)
 
         self.assertEqual(Content.objects.all().count(), 0)
+
+
+class GraphTests(TestCase):
+
+    @staticmethod
+    def render(num):
+        start = TwitterApi.start_datetime()
+        with Graph() as graph:
+            graph.plot([start, datetime.now(timezone('Asia/Tokyo'))],
+                       [num, num + 1], start)
+            return graph.plt_to_svg()
+
+    def test_render_in_threads(self):
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            svg_list = list(executor.map(self.render, range(8)))
+
+        for svg in svg_list:
+            self.assertIn(b'<svg', svg)
+
+    def test_release_figure(self):
+        graph = Graph()
+        with graph:
+            graph.plot([], [], TwitterApi.start_datetime())
+            graph.plt_to_svg()
+
+        self.assertIsNone(graph.figure)
@@ -0,0 +1,155 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from .. import factory
+from ..management.commands.refresh_daemon import Command as RefreshDaemon
+from ..models import Content
+from ..models import FetchFailure
+from ..models import Ranking
+from ..models import SyncCursor
+from ..scheduler import FULL_FETCH_CALLS
+from ..scheduler import RefreshScheduler
+
+
+def create_account(name, tweet_count=0, count=0, synced_days_ago=1,
+                   release_date=None):
+    now = timezone.now()
+    content = factory.ContentFactory(name=name, screen_name=name,
+                                     release_date=release_date)
+    twitter_user = factory.TwitterUserFactory(content=content)
+    for num in range(tweet_count):
+        tweet = factory.TweetFactory(
+            twitter_user=twitter_user, tweet_id='{}-{}'.format(name, num),
+            tweet_date=now - timedelta(hours=num + 1))
+        factory.TweetCountFactory(tweet=tweet, retweet_count=count,
+                                  favorite_count=count)
+    cursor = SyncCursor.record(twitter_user)
+    SyncCursor.objects.filter(pk=cursor.pk).update(
+        last_sync_at=now - timedelta(days=synced_days_ago))
+    return content
+
+
+def load_contents():
+    return Content.objects.select_related('twitteruser__synccursor',
+                                          'fetchfailure')
+
+
+class RefreshSchedulerTests(TestCase):
+
+    def test_active_account_first(self):
+        create_account('dormant')
+        create_account('active', tweet_count=10, count=100)
+
+        candidates = RefreshScheduler().candidates(load_contents())
+
+        self.assertEqual([candidate.content.name for candidate in candidates],
+                         ['active', 'dormant'])
+
+    def test_stale_dormant_account_comes_around(self):
+        create_account('dormant', synced_days_ago=60)
+        create_account('active', tweet_count=2, count=1,
+                        synced_days_ago=0.01)
+
+        candidates = RefreshScheduler().candidates(load_contents())
+
+        self.assertEqual(candidates[0].content.name, 'dormant')
+
+    def test_release_date_proximity(self):
+        today = timezone.now().date()
+        create_account('old', release_date=today - timedelta(days=300))
+        create_account('airing', release_date=today)
+
+        candidates = RefreshScheduler().candidates(load_contents())
+
+        self.assertEqual(candidates[0].content.name, 'airing')
+
+    def test_never_fetched_account_first(self):
+        create_account('active', tweet_count=10, count=100)
+        factory.ContentFactory(name='new', screen_name='new')
+
+        candidates = RefreshScheduler().candidates(load_contents())
+
+        self.assertEqual(candidates[0].content.name, 'new')
+        self.assertEqual(candidates[0].cost, FULL_FETCH_CALLS)
+
+    def test_failed_new_account_does_not_take_budget(self):
+        create_account('active', tweet_count=10, count=100)
+        broken = factory.ContentFactory(name='broken', screen_name='broken')
+        FetchFailure.record(broken)
+
+        picked = RefreshScheduler().pick(load_contents(), FULL_FETCH_CALLS)
+
+        self.assertEqual([candidate.content.name for candidate in picked],
+                         ['active'])
+
+    def test_failed_account_score_decays(self):
+        broken = factory.ContentFactory(name='broken', screen_name='broken')
+        FetchFailure.record(broken)
+        scheduler = RefreshScheduler(now=timezone.now() + timedelta(days=2))
+        score = scheduler.candidates(load_contents())[0].score
+        FetchFailure.record(broken)
+
+        decayed = scheduler.candidates(load_contents())[0].score
+
+        self.assertLess(decayed, score)
+        self.assertGreater(decayed, 0)
+
+    def test_candidates_without_per_content_queries(self):
+        for num in range(3):
+            content = create_account('active{}'.format(num), tweet_count=2,
+                                     count=10)
+            FetchFailure.record(content)
+        contents = list(load_contents())
+
+        with self.assertNumQueries(1):
+            RefreshScheduler().candidates(contents)
+
+    def test_recent_activity_in_one_query(self):
+        content = create_account('active', tweet_count=3, count=100)
+
+        with self.assertNumQueries(1):
+            activity = RefreshScheduler().recent_activity(
+                [content.twitteruser])
+
+        self.assertEqual(activity[content.twitteruser.pk], (3, 9.0))
+
+    def test_pick_within_budget(self):
+        create_account('active', tweet_count=10, count=100)
+        create_account('dormant')
+        factory.ContentFactory(name='new', screen_name='new')
+
+        picked = RefreshScheduler().pick(load_contents(), 5)
+
+        self.assertEqual([candidate.content.name for candidate in picked],
+                         ['active', 'dormant'])
+        self.assertLessEqual(sum(candidate.cost for candidate in picked), 5)
+
+
+class RefreshDaemonTests(TestCase):
+
+    def test_refresh(self):
+        content = create_account('active', tweet_count=3, count=100)
+        fetcher = mock.Mock()
+        fetcher.update_contents.side_effect = \
+            lambda contents, **kwargs: iter(contents)
+
+        updated = RefreshDaemon.refresh(fetcher, 10)
+
+        self.assertEqual(updated, [content])
+        self.assertTrue(Ranking.objects.filter(content=content).exists())
+
+    def test_refresh_safely_survives_error(self):
+        fetcher = mock.Mock()
+        fetcher.update_contents.side_effect = ConnectionError('timeout')
+        create_account('active', tweet_count=3, count=100)
+
+        module = 'ranking.management.commands.refresh_daemon.'
+        with mock.patch(module + 'traceback.print_exc'), \
+                mock.patch(module + 'close_old_connections') as mock_close:
+            updated = RefreshDaemon.refresh_safely(fetcher, 10)
+
+        self.assertEqual(updated, [])
+        self.assertEqual(mock_close.call_count, 2)
@@ -0,0 +1,47 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.test import SimpleTestCase
+
+from ..management.commands.startup_benchmark import HEAVY_MODULES
+from ..management.commands.startup_benchmark import parse_importtime
+
+LOADED_MODULES_SCRIPT = '''
+import importlib
+import json
+import sys
+import django
+django.setup()
+from django.conf import settings
+importlib.import_module(settings.ROOT_URLCONF)
+print(json.dumps(sorted(sys.modules)))
+'''
+
+
+class StartupTests(SimpleTestCase):
+
+    def test_heavy_modules_are_not_imported_on_startup(self):
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        output = subprocess.check_output(
+            [sys.executable, '-c', LOADED_MODULES_SCRIPT],
+            cwd=settings.BASE_DIR, env=env, universal_newlines=True)
+
+        modules = json.loads(output.splitlines()[-1])
+
+        self.assertIn('ranking.views', modules)
+        for name in HEAVY_MODULES + ['numpy']:
+            self.assertNotIn(name, modules)
+
+    def test_parse_importtime(self):
+        output = '\n'.join([
+            'import time: self [us] | cumulative | imported package',
+            'import time:       120 |        120 |   ranking.utils',
+            'import time:       300 |        420 | ranking',
+            'import time:        50 |         50 | json',
+        ])
+
+        self.assertEqual(parse_importtime(output),
+                         {'ranking': 420, 'json': 50})
@@ -0,0 +1,127 @@
+from django.core.cache import cache
+from django.test import RequestFactory
+from django.test import TestCase
+
+from ..factory import CategoryFactory
+from ..factory import ContentFactory
+from ..models import Category
+from ..models import Ranking
+from ..registry import CategoryRegistry
+from ..registry import category_registry
+from ..utils import RANKING_GENERATION_KEY
+from ..utils import RankedPaginator
+from ..utils import bump_ranking_generation
+from ..utils import get_ranking_generation
+from ..utils import paging
+
+
+class RankedPaginatorTests(TestCase):
+
+    def setUp(self):
+        self.category = CategoryFactory(name='アニメ')
+        self.contents = [ContentFactory(category=self.category)
+                         for _ in range(25)]
+        Ranking.objects.bulk_create([
+            Ranking(category=self.category, content=content, rank=rank)
+            for rank, content in enumerate(self.contents, 1)])
+
+    def test_page_by_rank_range(self):
+        rankings = Ranking.objects.filter(category=self.category)
+        paginator = RankedPaginator(rankings, 10, rank_field='rank')
+
+        with self.assertNumQueries(2):
+            page = paginator.page(3)
+            ranks = [ranking.rank for ranking in page]
+
+        self.assertEqual(ranks, list(range(21, 26)))
+        self.assertEqual(page.start_index(), 21)
+        self.assertFalse(page.has_next())
+
+    def test_deep_page_does_not_use_offset(self):
+        rankings = Ranking.objects.filter(category=self.category)
+        paginator = RankedPaginator(rankings, 10, rank_field='rank')
+
+        with self.assertNumQueries(2) as queries:
+            list(paginator.page(2))
+
+        self.assertNotIn('OFFSET', queries.captured_queries[-1]['sql'])
+
+    def test_page_with_rank_gap(self):
+        self.contents[4].delete()
+        rankings = Ranking.objects.filter(category=self.category)
+        paginator = RankedPaginator(rankings, 10, rank_field='rank')
+
+        ranks = [[ranking.rank for ranking in paginator.page(number)]
+                 for number in paginator.page_range]
+
+        self.assertEqual(paginator.count, 24)
+        self.assertEqual([len(page_ranks) for page_ranks in ranks],
+                         [10, 10, 4])
+        self.assertEqual(ranks[1], list(range(12, 22)))
+
+    def test_paging_with_rank_field(self):
+        request = RequestFactory().get('/', {'p': '9'})
+        rankings = Ranking.objects.filter(category=self.category)
+
+        page = paging(request, rankings, 10, rank_field='rank')
+
+        self.assertEqual(page.number, 3)
+        self.assertEqual(len(page), 5)
+
+
+class RankingGenerationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_bump_generation(self):
+        generation = get_ranking_generation()
+
+        bumped = bump_ranking_generation()
+
+        self.assertGreater(bumped, generation)
+        self.assertEqual(get_ranking_generation(), bumped)
+
+    def test_generation_not_reused_after_eviction(self):
+        generations = {get_ranking_generation(), bump_ranking_generation()}
+        cache.delete(RANKING_GENERATION_KEY)
+        generations.add(get_ranking_generation())
+        cache.delete(RANKING_GENERATION_KEY)
+        generations.add(bump_ranking_generation())
+
+        self.assertEqual(len(generations), 4)
+
+
+class CategoryRegistryTests(TestCase):
+
+    def setUp(self):
+        self.registry = CategoryRegistry()
+
+    def test_load_once(self):
+        self.registry.all()
+
+        with self.assertNumQueries(0):
+            categories = self.registry.all()
+            anime = self.registry.get(categories[0].pk)
+
+        self.assertEqual(anime, categories[0])
+
+    def test_created_by_migration(self):
+        names = [category.name for category in self.registry.all()]
+
+        self.assertIn('アニメ', names)
+        self.assertIn('ドラマ', names)
+
+    def test_reload_after_ttl(self):
+        registry = CategoryRegistry(ttl=0)
+        registry.all()
+
+        with self.assertNumQueries(1):
+            registry.all()
+
+    def test_invalidate_on_save(self):
+        category_registry.all()
+
+        category = Category.objects.create(name='映画')
+
+        self.assertIn(category, category_registry.all())
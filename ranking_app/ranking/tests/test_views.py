@@ -1,4 +1,12 @@
+from datetime import datetime
+from pytz import timezone
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import Client
 from django.test import TestCase
+from django.test import override_settings
 from django.urls import reverse
 
 from ..factory import CategoryFactory
@@ -8,6 +16,15 @@ from ..factory import TweetFactory
 from ..factory import TweetCountFactory
 from ..factory import StaffFactory
 from ..models import Content
+from ..models import Ranking
+from ..registry import category_registry
+from ..utils import bump_ranking_generation
+
+# カテゴリー一覧を読み込み済みの時の詳細ページのクエリ数(コンテンツ、スタッフ、人気ツイートの集計と取得)。
+# ツイートやスタッフの数が増えても変わらない。
+DETAIL_QUERIES = 4
+# カテゴリー一覧を読み込み済みの時の一覧ページのクエリ数(件数、ランキング、キャスト)
+CATEGORY_QUERIES = 3
 
 
 def create_content_with_data(category, name=None, retweet=None):
@@ -26,6 +43,9 @@ def create_content_with_data(category, name=None, retweet=None):
 
 class RankingIndexViewTests(TestCase):
 
+    def setUp(self):
+        cache.clear()
+
     def test_display_only_high_rank_content(self):
         anime = CategoryFactory(name='アニメ')
         CategoryFactory(name='ドラマ')
@@ -36,6 +56,7 @@ class RankingIndexViewTests(TestCase):
                                          100 - num))
         for num in range(50):
             create_content_with_data(anime, 'Not popular{}'.format(num), num)
+        Ranking.refresh(anime)
 
         response = self.client.get(reverse('ranking:index'))
         self.assertEqual(response.status_code, 200)
@@ -44,13 +65,31 @@ class RankingIndexViewTests(TestCase):
             self.assertContains(response, content.appraise())
         self.assertNotContains(response, "Not popular")
 
+    def test_cached_fragment_until_generation_bumped(self):
+        anime = CategoryFactory(name='アニメ')
+        content = create_content_with_data(anime, 'before update', 10)
+        Ranking.refresh(anime)
+        self.client.get(reverse('ranking:index'))
+        Content.objects.filter(pk=content.pk).update(name='after update')
+
+        cached = self.client.get(reverse('ranking:index'))
+        bump_ranking_generation()
+        updated = self.client.get(reverse('ranking:index'))
+
+        self.assertContains(cached, 'before update')
+        self.assertContains(updated, 'after update')
+
 
 class CategoryViewTests(TestCase):
 
+    def setUp(self):
+        cache.clear()
+
     def test_anime_category(self):
         anime = CategoryFactory(name='アニメ')
         for _ in range(30):
             create_content_with_data(anime)
+        Ranking.refresh(anime)
 
         sort_info = Content.sort_twitter_rating_by(anime)
         contents = [info['content'] for info in sort_info]
@@ -74,15 +113,51 @@ class CategoryViewTests(TestCase):
         anime = CategoryFactory(name='アニメ')
         for _ in range(30):
             create_content_with_data(anime)
+        Ranking.refresh(anime)
 
         response = self.client.get(reverse('ranking:category', args=[anime.id]))
 
         self.assertContains(response, 'p=1')
         self.assertContains(response, 'p=2')
 
+    def test_constant_number_of_queries(self):
+        anime = CategoryFactory(name='アニメ')
+        for _ in range(30):
+            content = create_content_with_data(anime)
+            for _ in range(6):
+                StaffFactory(is_cast=True, content=content)
+        Ranking.refresh(anime)
+        category_registry.invalidate()
+        category_registry.all()
+
+        with self.assertNumQueries(CATEGORY_QUERIES):
+            response = self.client.get(
+                reverse('ranking:category', args=[anime.id]))
+
+        for info in response.context['contents_info']:
+            self.assertEqual(len(info.content.main_performers()), 4)
+
+    def test_cached_box(self):
+        anime = CategoryFactory(name='アニメ')
+        content = create_content_with_data(anime)
+        Ranking.refresh(anime)
+        url = reverse('ranking:category', args=[anime.id])
+        self.client.get(url)
+        cast = StaffFactory(is_cast=True, content=content)
+
+        cached = self.client.get(url)
+        bump_ranking_generation()
+        updated = self.client.get(url)
+
+        self.assertNotContains(cached, cast.name)
+        self.assertContains(updated, cast.name)
+
 
 class ContentDetailViewTests(TestCase):
 
+    def setUp(self):
+        cache.clear()
+
     def test_works_fine(self):
         anime = CategoryFactory(name='アニメ')
         content = create_content_with_data(anime)
@@ -108,3 +183,166 @@ class ContentDetailViewTests(TestCase):
         self.assertContains(response, cast.role)
         self.assertContains(response, staff.name)
         self.assertContains(response, staff.role)
+
+    def test_constant_number_of_queries(self):
+        anime = CategoryFactory(name='アニメ')
+        content = create_content_with_data(anime)
+        Ranking.refresh(anime)
+        twitter_user = content.twitteruser
+        for num in range(10):
+            tweet = TweetFactory(twitter_user=twitter_user,
+                                 tweet_date=datetime.now(timezone('Asia/Tokyo')))
+            TweetCountFactory(tweet=tweet)
+            StaffFactory(is_cast=num % 2 == 0, content=content)
+        url = reverse('ranking:content_detail', args=[content.id])
+        category_registry.invalidate()
+        category_registry.all()
+
+        with self.assertNumQueries(DETAIL_QUERIES):
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['detail'].performers), 5)
+        self.assertEqual(len(response.context['detail'].only_staff), 5)
+
+
+class PageCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        anime = CategoryFactory(name='アニメ')
+        self.content = create_content_with_data(anime, 'before update')
+        Ranking.refresh(anime)
+        self.url = reverse('ranking:content_detail', args=[self.content.id])
+
+    def test_cached_page(self):
+        response = self.client.get(self.url)
+
+        with self.assertNumQueries(0):
+            cached = self.client.get(self.url)
+
+        self.assertEqual(cached.content, response.content)
+
+    def test_render_again_after_bump(self):
+        self.client.get(self.url)
+        Content.objects.filter(pk=self.content.pk).update(name='after update')
+
+        cached = self.client.get(self.url)
+        bump_ranking_generation()
+        updated = self.client.get(self.url)
+
+        self.assertContains(cached, 'before update')
+        self.assertContains(updated, 'after update')
+
+    def test_ignores_unused_query_params(self):
+        response = self.client.get(self.url)
+
+        with self.assertNumQueries(0):
+            cached = self.client.get(self.url, {'utm_source': 'twitter'})
+
+        self.assertEqual(cached.content, response.content)
+
+    def test_render_again_after_admin_delete(self):
+        url = reverse('ranking:category', args=[self.content.category_id])
+        self.assertContains(self.client.get(url), 'before update')
+        admin_client = Client()
+        admin_client.force_login(User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password'))
+
+        admin_client.post(reverse('admin:ranking_content_delete',
+                                  args=[self.content.id]), {'post': 'yes'})
+
+        self.assertNotContains(self.client.get(url), 'before update')
+
+    def test_not_cached_for_logged_in_user(self):
+        user = User.objects.create_user('staff', password='password')
+        self.client.force_login(user)
+        self.client.get(self.url)
+        Content.objects.filter(pk=self.content.pk).update(name='after update')
+
+        response = self.client.get(self.url)
+
+        self.assertContains(response, 'after update')
+
+
+class RankGraphViewTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        anime = CategoryFactory(name='アニメ')
+        self.content = ContentFactory(category=anime)
+        twitter_user = TwitterUserFactory(content=self.content)
+        for num in range(3):
+            tweet = TweetFactory(twitter_user=twitter_user,
+                                 tweet_date=datetime.now(timezone('Asia/Tokyo')))
+            TweetCountFactory(tweet=tweet)
+        self.url = reverse('ranking:content_rank_graph', args=[self.content.id])
+
+    def test_cached_graph(self):
+        with mock.patch('ranking.views.sparkline_svg',
+                        return_value=b'<svg></svg>') as mock_sparkline_svg:
+            response = self.client.get(self.url)
+            self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertTrue(response.has_header('ETag'))
+        self.assertTrue(response.has_header('Last-Modified'))
+        mock_sparkline_svg.assert_called_once()
+
+    def test_sparkline_graph(self):
+        response = self.client.get(self.url)
+
+        self.assertTrue(response.content.startswith(b'<svg'))
+        self.assertContains(response, '<polyline')
+
+    @override_settings(RANK_GRAPH_BACKEND='matplotlib')
+    def test_matplotlib_graph(self):
+        with mock.patch('ranking.graph.Graph.set_rank_graph',
+                        autospec=True) as mock_set_rank_graph:
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        mock_set_rank_graph.assert_called_once()
+
+    def test_graph_data(self):
+        url = reverse('ranking:content_rank_graph_data',
+                      args=[self.content.id])
+
+        response = self.client.get(url)
+
+        data = response.json()
+        self.assertEqual(data['content_id'], self.content.id)
+        self.assertEqual(len(data['dates']), 3)
+        self.assertEqual(len(data['points']), 3)
+        self.assertTrue(response.has_header('ETag'))
+
+    def test_not_modified(self):
+        response = self.client.get(self.url)
+
+        not_modified = self.client.get(
+            self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_render_again_after_backend_change(self):
+        response = self.client.get(self.url)
+
+        with override_settings(RANK_GRAPH_BACKEND='matplotlib'), \
+                mock.patch('ranking.graph.Graph.set_rank_graph',
+                           autospec=True):
+            updated = self.client.get(
+                self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+        self.assertEqual(updated.status_code, 200)
+        self.assertNotEqual(updated['ETag'], response['ETag'])
+
+    def test_render_again_after_update(self):
+        response = self.client.get(self.url)
+        self.content.twitteruser.add_tweet_counts(0, 10, 10)
+
+        updated = self.client.get(
+            self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+        self.assertEqual(updated.status_code, 200)
+        self.assertNotEqual(updated['ETag'], response['ETag'])
@@ -0,0 +1,534 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from datetime import datetime
+from datetime import timedelta
+from itertools import chain
+import json
+import queue
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+import environ
+from requests_oauthlib import OAuth1Session
+
+from .models import Content
+from .models import FetchFailure
+from .models import SyncCursor
+from .models import Tweet
+from .models import TweetCount
+from .models import TwitterUser
+from .utils import quarter_start_datetime
+
+
+TIMELINE_COUNT = '200'
+TIMELINE_TRIM_USER = 'true'
+TIMELINE_INCLUDE_RTS = 'false'
+TWEET_BATCH_SIZE = 500
+FETCH_WORKERS = 4
+# タイムラインを保存している間に先読みしておくページ数
+TIMELINE_PREFETCH_PAGES = 2
+# レスポンスヘッダーからエンドポイントごとの残りリクエスト数とリセット時刻(UNIX時間)を読み取る
+RATE_LIMIT_REMAINING_HEADER = 'x-rate-limit-remaining'
+RATE_LIMIT_RESET_HEADER = 'x-rate-limit-reset'
+# 429や5xxが返ってきた時のリトライ回数と待ち時間(秒)。待ち時間はリトライごとに倍にする
+API_MAX_RETRIES = 3
+API_BACKOFF_SECONDS = 2
+
+
+class TwitterApiError(Exception):
+    """
+    TwitterAPIがエラーを返した時の例外
+    """
+
+
+class PageBuffer(object):
+    """
+    別スレッドで取得したページを最大depthページまで受け渡すバッファ。
+    取得するスレッドがproduceを呼び、保存するスレッドがイテレートする。
+    保存側が途中でやめた時はcloseで取得側を止める。
+    """
+
+    def __init__(self, depth=TIMELINE_PREFETCH_PAGES):
+        self.buffer = queue.Queue(maxsize=depth)
+        self.stopped = threading.Event()
+        self.done = object()
+
+    def put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce(self, pages):
+        """
+        pagesを順にバッファに入れる。pagesで起きた例外は保存側のスレッドで送出する。
+        :param pages: ページのイテラブル
+        """
+        try:
+            for page in pages:
+                if not self.put((page, None)):
+                    return
+            self.put((self.done, None))
+        except Exception as e:
+            self.put((self.done, e))
+
+    def close(self):
+        self.stopped.set()
+
+    def __iter__(self):
+        try:
+            while True:
+                page, error = self.buffer.get()
+                if error is not None:
+                    raise error
+                if page is self.done:
+                    return
+                yield page
+        finally:
+            self.close()
+
+
+def prefetch_pages(pages, depth=TIMELINE_PREFETCH_PAGES):
+    """
+    別スレッドでpagesを先読みしながら順に返す。DBへの保存中に次のページのHTTPリクエストを進められる。
+    先読みはdepthページまでなので、メモリに持つページ数は一定になる。
+    pagesで起きた例外は呼び出し元のスレッドで送出する。
+    途中でやめる時は先読みのスレッドを止めるために、返したジェネレーターをcloseする。
+    :param pages: ページのイテラブル
+    :param depth: int 先読みするページ数
+    :return: ページを順に返すジェネレーター
+    """
+    buffer = PageBuffer(depth)
+    producer = threading.Thread(target=buffer.produce, args=(pages,),
+                                daemon=True)
+    producer.start()
+    try:
+        yield from buffer
+    finally:
+        buffer.close()
+        producer.join()
+
+
+class EndpointBudget(object):
+    """
+    エンドポイント１つ分の残りリクエスト数。レスポンスヘッダーの値で更新する。
+    """
+
+    def __init__(self):
+        self.remaining = None
+        self.reset_at = None
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        リクエストを１回分予約する。残りがなければリセット時刻まで待つ。
+        待つ間はロックを離すので、他のスレッドがupdateで新しい残り回数を設定できる。
+        """
+        waited_reset_at = None
+        while True:
+            with self.lock:
+                now = time.time()
+                if self.reset_at is not None and (
+                        now >= self.reset_at or
+                        self.reset_at == waited_reset_at):
+                    self.remaining, self.reset_at = None, None
+                if self.remaining is None:
+                    return
+                if self.remaining > 0:
+                    self.remaining -= 1
+                    return
+                waited_reset_at = self.reset_at
+                wait = self.reset_at - now
+            # 起きた後に、待っている間に更新された残り回数を確認し直す
+            time.sleep(wait)
+
+    def update(self, remaining, reset_at):
+        with self.lock:
+            self.remaining = remaining
+            self.reset_at = reset_at
+
+
+class RateLimiter(object):
+    """
+    TwitterAPIのレート制限をエンドポイントごとに管理する。複数のスレッドで共有できる。
+    レスポンスヘッダーで残りがなくなったエンドポイントだけ、リセット時刻まで待つ。
+    """
+
+    def __init__(self, remaining_header=RATE_LIMIT_REMAINING_HEADER,
+                 reset_header=RATE_LIMIT_RESET_HEADER):
+        self.remaining_header = remaining_header
+        self.reset_header = reset_header
+        self.budgets = {}
+        self.lock = threading.Lock()
+
+    def get_budget(self, endpoint):
+        with self.lock:
+            if endpoint not in self.budgets:
+                self.budgets[endpoint] = EndpointBudget()
+            return self.budgets[endpoint]
+
+    def acquire(self, endpoint):
+        self.get_budget(endpoint).acquire()
+
+    def update(self, endpoint, headers):
+        """
+        :param endpoint: str
+        :param headers: dict レスポンスヘッダー
+        :return bool: ヘッダーからレート制限の情報を読み取れたかどうか
+        """
+        remaining = headers.get(self.remaining_header)
+        reset_at = headers.get(self.reset_header)
+        if remaining is None or reset_at is None:
+            return False
+        self.get_budget(endpoint).update(int(remaining), int(reset_at))
+        return True
+
+
+class TwitterApi(object):
+    def __init__(self, rate_limiter=None):
+        self.rate_limiter = rate_limiter or RateLimiter()
+        env = environ.Env()
+        environ.Env.read_env('.env')
+        self.__consumer_key = env('CONSUMER_KEY')
+        self.__consumer_secret = env('CONSUMER_SECRET')
+        self.__access_token = env('ACCESS_TOKEN')
+        self.__secret_token = env('SECRET_TOKEN')
+        self.__api = self.auth_twitter()
+
+    def auth_twitter(self):
+        api = OAuth1Session(self.__consumer_key,
+                            self.__consumer_secret,
+                            self.__access_token,
+                            self.__secret_token)
+        return api
+
+    def get_base(self, url, query_dict):
+        """
+        TwitterAPIにGETリクエストを送る。レート制限の残りがなければリセットまで待ち、
+        429や5xxが返ってきた場合は間隔をあけてリトライする。
+        :raise TwitterApiError: エラーが返ってきた場合
+        """
+        endpoint = re.sub(r'^https://api.twitter.com/1.1/|\.json$', '', url)
+        for retry in range(API_MAX_RETRIES + 1):
+            self.rate_limiter.acquire(endpoint)
+            response = self.__api.get(url, params=query_dict)
+            has_limit = self.rate_limiter.update(endpoint, response.headers)
+            if response.status_code == 429 or response.status_code >= 500:
+                if retry < API_MAX_RETRIES and not (
+                        response.status_code == 429 and has_limit):
+                    time.sleep(API_BACKOFF_SECONDS * 2 ** retry)
+                continue
+            # エラーのレスポンスはJSONとは限らないので、ステータスコードを先に確認する
+            if response.status_code >= 400:
+                raise TwitterApiError('{} {}: {}'.format(
+                    endpoint, response.status_code, response.text))
+            try:
+                result = json.loads(response.text)
+            except ValueError:
+                raise TwitterApiError('{} {}: JSONではないレスポンスです。{}'.format(
+                    endpoint, response.status_code, response.text))
+            if isinstance(result, dict) and 'errors' in result:
+                raise TwitterApiError('{} {}: {}'.format(
+                    endpoint, response.status_code, response.text))
+            return result
+        raise TwitterApiError('{} {}: リトライの上限に達しました。'.format(
+            endpoint, response.status_code))
+
+    def get_simple_timeline(self, screen_name, max_id=None, since_id=None):
+        timeline_url = "https://api.twitter.com/1.1/statuses/user_timeline.json"
+        query = {
+            "screen_name": screen_name,
+            "count": TIMELINE_COUNT,
+            "trim_user": TIMELINE_TRIM_USER,
+            "include_rts": TIMELINE_INCLUDE_RTS}
+        if max_id or max_id == 0:
+            query["max_id"] = max_id
+        if since_id:
+            query["since_id"] = since_id
+        return self.get_base(timeline_url, query)
+
+    def iter_timeline_pages(self, screen_name, since_id=None, stop_id=None):
+        """
+        タイムラインを新しい順に１ページずつ取得する。
+        stop_id以下のツイートを含むページまで取得したら、空のページを確認せずに終わる。
+        :param stop_id: int 取得済みのツイートID
+        :return: 空でないページ(ツイートのlist)を順に返すジェネレーター
+        """
+        page = self.get_simple_timeline(screen_name, since_id=since_id)
+        while page:
+            yield page
+            if stop_id is not None and page[-1]["id"] <= stop_id:
+                return
+            page = self.get_simple_timeline(
+                screen_name, max_id=page[-1]["id"] - 1, since_id=since_id)
+
+    def get_most_timeline(self, screen_name, since_id=None, stop_id=None):
+        return list(chain.from_iterable(self.iter_timeline_pages(
+            screen_name, since_id=since_id, stop_id=stop_id)))
+
+    def get_user(self, screen_name):
+        user_url = "https://api.twitter.com/1.1/users/show.json"
+        query = {"screen_name": screen_name}
+        return self.get_base(user_url, query)
+
+    @staticmethod
+    def store_user(screen_name, user_data, content=None):
+        """
+        get_userメソッドで取得したデータを元にTwitterUserモデル作成・アップデートする
+        :param screen_name: str
+        :param user_data: list　
+        :param content: obj　コンテンツがあればTwitterUserのupdate、なければcreateになる
+        :return TwitterUser: obj
+        """
+        if not content:
+            content = Content.objects.get(screen_name=screen_name)
+        twitter_user_args = {}
+        fields_list = ['name', 'url', 'description', 'profile_image_url_https',
+                       'profile_banner_url', 'followers_count']
+        for attr_key, attr_value in user_data.items():
+            if attr_key in fields_list:
+                if attr_key == 'profile_image_url_https':
+                    twitter_user_args['icon_url'] = attr_value
+                elif attr_key == 'url':
+                    twitter_user_args['official_url'] = attr_value
+                elif attr_key == 'profile_banner_url':
+                    twitter_user_args['banner_url'] = attr_value
+                else:
+                    twitter_user_args[attr_key] = attr_value
+        return TwitterUser.objects.update_or_create(
+            defaults=twitter_user_args, content=content)[0]
+
+    @staticmethod
+    def store_timeline_data(timeline_data, twitter_user,
+                            batch_size=TWEET_BATCH_SIZE):
+        """
+        get_timelineメソッドで取得したデータをTwitterUserとTweetに保存する。
+        既存ツイートの検索、Tweetの作成・更新、TweetCountの作成はbatch_size件ずつまとめて行う。
+        リツイート数・いいね数が前回と変わっていないツイートのTweetCountは作らない。
+        :param timeline_data: list
+        :param twitter_user: obj
+        :param batch_size: int 1回のクエリで扱う件数
+        """
+        if timeline_data:
+            tweets_data = {tweet['id_str']: tweet for tweet in timeline_data}
+            tweet_dates = {
+                tweet_id: datetime.strptime(tweet['created_at'],
+                                            '%a %b %d %H:%M:%S %z %Y')
+                for tweet_id, tweet in tweets_data.items()}
+            tweet_ids = list(tweets_data)
+            existing_tweets = {}
+            for start in range(0, len(tweet_ids), batch_size):
+                existing_tweets.update(
+                    (tweet.tweet_id, tweet) for tweet in Tweet.objects.filter(
+                        tweet_id__in=tweet_ids[start:start + batch_size]
+                    ).with_latest_counts())
+            new_tweets, updated_tweets, changed_ids = [], [], set()
+            retweet_diff, favorite_diff = 0, 0
+            for tweet_id, tweet in tweets_data.items():
+                if tweet_id in existing_tweets:
+                    stored_tweet = existing_tweets[tweet_id]
+                    if (stored_tweet.latest_retweet_count,
+                            stored_tweet.latest_favorite_count) != (
+                            tweet['retweet_count'], tweet['favorite_count']):
+                        changed_ids.add(tweet_id)
+                    stored_tweet.twitter_user = twitter_user
+                    stored_tweet.tweet_date = tweet_dates[tweet_id]
+                    stored_tweet.text = tweet['text']
+                    updated_tweets.append(stored_tweet)
+                    retweet_diff -= stored_tweet.latest_retweet_count or 0
+                    favorite_diff -= stored_tweet.latest_favorite_count or 0
+                else:
+                    new_tweets.append(Tweet(
+                        tweet_id=tweet_id, twitter_user=twitter_user,
+                        tweet_date=tweet_dates[tweet_id], text=tweet['text']))
+                    changed_ids.add(tweet_id)
+                retweet_diff += tweet['retweet_count']
+                favorite_diff += tweet['favorite_count']
+            Tweet.objects.bulk_create(new_tweets, batch_size=batch_size)
+            Tweet.objects.bulk_update(
+                updated_tweets, ['twitter_user', 'tweet_date', 'text'],
+                batch_size=batch_size)
+            # bulk_createではMySQLだとpkが取得できないので作成したツイートのpkを取り直す
+            tweet_pks = {tweet_id: tweet.pk
+                         for tweet_id, tweet in existing_tweets.items()}
+            new_tweet_ids = [tweet.tweet_id for tweet in new_tweets]
+            for start in range(0, len(new_tweet_ids), batch_size):
+                tweet_pks.update(Tweet.objects.filter(
+                    tweet_id__in=new_tweet_ids[start:start + batch_size]
+                ).values_list('tweet_id', 'pk'))
+            TweetCount.objects.bulk_create(
+                [TweetCount(tweet_id=tweet_pks[tweet_id],
+                            retweet_count=tweet['retweet_count'],
+                            favorite_count=tweet['favorite_count'])
+                 for tweet_id, tweet in tweets_data.items()
+                 if tweet_id in changed_ids],
+                batch_size=batch_size)
+            twitter_user.add_tweet_counts(len(new_tweets), retweet_diff,
+                                          favorite_diff)
+
+    @classmethod
+    def store_timeline_pages(cls, pages, twitter_user,
+                             batch_size=TWEET_BATCH_SIZE):
+        """
+        タイムラインをページごとに保存する。全ページの取得を待たずに保存を始める。
+        :param pages: ページ(ツイートのlist)のイテラブル
+        :param twitter_user: obj
+        :param batch_size: int 1回のクエリで扱う件数
+        """
+        newest_id = None
+        for page in pages:
+            cls.store_timeline_data(page, twitter_user, batch_size)
+            newest_id = max([newest_id or 0] + [tweet['id'] for tweet in page])
+        SyncCursor.record(twitter_user, newest_id)
+
+    @classmethod
+    @transaction.atomic
+    def store_twitter_data(cls, content, user_data, pages):
+        """
+        取得済みのユーザー情報と、取得しながら渡されるタイムラインのページをTwitterUserとTweetに保存する
+        :param content: obj
+        :param user_data: dict
+        :param pages: ページ(ツイートのlist)のイテラブル
+        """
+        twitter_user = cls.store_user(content.screen_name, user_data, content)
+        cls.store_timeline_pages(pages, twitter_user)
+
+    @transaction.atomic
+    def get_and_store_twitter_data(self, content):
+        """
+        TwitterAPIからデータを取得して,TwitterUserとTweetのモデルを新規作成する
+        :param content: obj
+        """
+        screen_name = content.screen_name
+        if screen_name:
+            user_data = self.get_user(screen_name)
+            twitter_user = self.store_user(screen_name, user_data)
+            with closing(prefetch_pages(
+                    self.iter_timeline_pages(screen_name))) as pages:
+                self.store_timeline_pages(pages, twitter_user)
+
+    @staticmethod
+    def sync_window(twitter_user, active_days=None):
+        """
+        前回取得した後の新しいツイートと、active_days日以内のまだ反応が増えているツイートだけを
+        取得するためのsince_idとstop_idを返す。stop_idのツイートは取得済みなので、
+        それを含むページまで取得したら終わってよい。
+        :param twitter_user: obj
+        :param active_days: int リツイート数・いいね数を取得し直す日数
+        :return tuple: (since_id, stop_id) 取得済みのツイートがなければ(None, None)
+        """
+        if active_days is None:
+            active_days = settings.TWEET_ACTIVE_DAYS
+        active_start = timezone.now() - timedelta(days=active_days)
+        boundary_id = twitter_user.tweet_set.filter(
+            tweet_date__gte=active_start).order_by('tweet_date').values_list(
+            'tweet_id', flat=True).first()
+        if boundary_id is None:
+            boundary_id = SyncCursor.objects.filter(
+                twitter_user=twitter_user).values_list(
+                'newest_id', flat=True).first()
+        if boundary_id is None:
+            boundary_id = twitter_user.tweet_set.order_by(
+                '-tweet_date').values_list('tweet_id', flat=True).first()
+        if boundary_id is None:
+            return None, None
+        return int(boundary_id) - 1, int(boundary_id)
+
+    @classmethod
+    def start_datetime(cls):
+        return quarter_start_datetime()
+
+    @transaction.atomic
+    def update_data(self, content):
+        """
+        TwitterAPIからのデータを取得して、TwitterUserとTweetのモデルをアップデートする
+        :param content: obj
+        """
+        screen_name = content.screen_name
+        twitter_user = content.twitteruser
+        since_id, stop_id = self.sync_window(twitter_user)
+        user_data = self.get_user(screen_name)
+        updated_twitter_user = self.store_user(screen_name, user_data, content)
+        with closing(prefetch_pages(self.iter_timeline_pages(
+                screen_name, since_id=since_id, stop_id=stop_id))) as pages:
+            self.store_timeline_pages(pages, updated_twitter_user)
+
+
+class TwitterFetcher(object):
+    """
+    複数アカウントのTwitterデータをスレッドで並行して取得する。
+    レート制限は全スレッドで共有するRateLimiterで管理し、DBへの保存は呼び出し元のスレッドだけで行う。
+    取得したページはアカウントごとのPageBufferで受け渡すので、メモリに持つのはworkers×先読みページ数までになる。
+    """
+
+    def __init__(self, workers=FETCH_WORKERS, rate_limiter=None):
+        self.workers = workers
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.local = threading.local()
+
+    def get_api(self):
+        """
+        OAuth1Sessionはスレッド間で共有しないので、スレッドごとにTwitterApiを作る
+        """
+        if not hasattr(self.local, 'api'):
+            self.local.api = TwitterApi(rate_limiter=self.rate_limiter)
+        return self.local.api
+
+    def fetch(self, screen_name, since_id=None, stop_id=None):
+        """
+        :return: ユーザー情報、続いてタイムラインのページを順に返すジェネレーター
+        """
+        api = self.get_api()
+        yield api.get_user(screen_name)
+        yield from api.iter_timeline_pages(screen_name, since_id=since_id,
+                                           stop_id=stop_id)
+
+    def update_contents(self, contents, on_error=None):
+        """
+        contentsのTwitterデータを並行して取得し、渡した順に1アカウントずつ取得しながら保存する。
+        保存中のアカウント以外も、先読みページ数までは取得を進めておく。
+        TwitterUserがあるcontentは新しいツイートと最近のツイートだけ、ないcontentは全ツイートを取得する。
+        取得できなかったcontentはFetchFailureに記録して次に進む。
+        :param contents: contentのイテラブル
+        :param on_error: 取得できなかった時に(content, 例外)で呼ぶ関数。表示は呼び出し元で行う
+        :return: 保存が終わったcontentを順に返すジェネレーター
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures, streams = [], []
+            for content in contents:
+                if not content.screen_name:
+                    continue
+                since_id, stop_id = None, None
+                if content.has_tweets():
+                    since_id, stop_id = TwitterApi.sync_window(
+                        content.twitteruser)
+                buffer = PageBuffer()
+                futures.append(executor.submit(
+                    buffer.produce,
+                    self.fetch(content.screen_name, since_id, stop_id)))
+                streams.append((content, buffer))
+            try:
+                for content, buffer in streams:
+                    try:
+                        with closing(iter(buffer)) as items:
+                            TwitterApi.store_twitter_data(
+                                content, next(items), items)
+                    except TwitterApiError as e:
+                        FetchFailure.record(content)
+                        if on_error:
+                            on_error(content, e)
+                        continue
+                    FetchFailure.clear(content)
+                    yield content
+            finally:
+                for future in futures:
+                    future.cancel()
+                for _, buffer in streams:
+                    buffer.close()
@@ -10,4 +10,6 @@ urlpatterns = [
          name='content_detail'),
     path('content/<int:content_id>/rank_graph', views.get_svg,
          name='content_rank_graph'),
+    path('content/<int:content_id>/rank_graph.json', views.get_graph_data,
+         name='content_rank_graph_data'),
 ]
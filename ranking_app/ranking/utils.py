@@ -1,14 +1,159 @@
+from datetime import datetime
+from functools import wraps
+import hashlib
+from pytz import timezone
+import time
+from urllib.parse import urlencode
+
+from django.core.cache import cache
 from django.core.paginator import Paginator
+from django.db.models import Count
+from django.db.models import Max
+from django.utils.functional import cached_property
+
+# ランキングの世代番号のキャッシュキー。データを取得するたびに新しくし、テンプレートのキャッシュキーに使う
+RANKING_GENERATION_KEY = 'ranking_generation'
+# ページ全体をキャッシュする時間(秒)
+PAGE_CACHE_TIMEOUT = 60 * 60 * 24
+# ページキャッシュのキーに含めるクエリ文字列。ビューが使うページ番号だけ
+PAGE_CACHE_QUERY_PARAMS = ('p',)
+
+
+class RankedPaginator(Paginator):
+    """
+    順位順に並んだquerysetを、rank_fieldの順位でDBでページングする。
+    OFFSETを使わずに前のページの最後の順位より後ろをper_page件取得するので、
+    後ろのページも先頭と同じコストで取得できる。
+    作品の削除などで順位が連番でなくなった場合は、前のページの最後の順位だけを取得してから絞り込む。
+    """
+
+    def __init__(self, object_list, per_page, rank_field, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.rank_field = rank_field
+        self.ranks_contiguous = False
+
+    @cached_property
+    def count(self):
+        # 件数と最後の順位が同じなら、順位は1からの連番になっている
+        stats = self.object_list.aggregate(
+            count=Count('pk'), last_rank=Max(self.rank_field))
+        self.ranks_contiguous = stats['count'] == (stats['last_rank'] or 0)
+        return stats['count']
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page
+        if top + self.orphans >= self.count:
+            top = self.count
+        objects = self.object_list.order_by(self.rank_field)
+        if self.ranks_contiguous or bottom == 0:
+            last_rank = bottom
+        else:
+            last_rank = objects.values_list(
+                self.rank_field, flat=True)[bottom - 1]
+        objects = objects.filter(**{self.rank_field + '__gt': last_rank})
+        return self._get_page(list(objects[:top - bottom]), number, self)
 
 
-def paging(request, objs, display_number):
+def paging(request, objs, display_number, rank_field=None):
     """
     インスタンス集合であるobjsをページングに対応させる
     :param request:
     :param objs: インスタンスの集合
     :param display_number: １ページ当たりの表示数
+    :param rank_field: 順位のフィールド名。指定するとOFFSETを使わずに順位でページングする
     :return:
     """
-    paginator = Paginator(objs, display_number)
+    if rank_field:
+        paginator = RankedPaginator(objs, display_number, rank_field)
+    else:
+        paginator = Paginator(objs, display_number)
     p = request.GET.get('p')
     return paginator.get_page(p)
+
+
+def quarter_start_datetime():
+    """
+    今期(四半期)の開始日時を返す。ランキングやグラフは今期のツイートを対象にする。
+    :return datetime:
+    """
+    ja_tz = timezone('Asia/Tokyo')
+    current_month = datetime.now().month
+    current_year = datetime.now().year
+    if current_month in [1, 2, 3]:
+        return datetime(current_year, 1, 1, tzinfo=ja_tz)
+    elif current_month in [4, 5, 6]:
+        return datetime(current_year, 4, 1, tzinfo=ja_tz)
+    elif current_month in [7, 8, 9]:
+        return datetime(current_year, 7, 1, tzinfo=ja_tz)
+    elif current_month in [10, 11, 12]:
+        return datetime(current_year, 10, 1, tzinfo=ja_tz)
+
+
+def new_ranking_generation():
+    """
+    新しい世代番号を返す。キャッシュから世代番号が消えても以前の番号を使い回さないように、現在時刻(ナノ秒)を使う
+    :return int:
+    """
+    return time.time_ns()
+
+
+def get_ranking_generation():
+    """
+    現在のランキングの世代番号を返す
+    :return int:
+    """
+    cache.add(RANKING_GENERATION_KEY, new_ranking_generation(), None)
+    return cache.get(RANKING_GENERATION_KEY) or new_ranking_generation()
+
+
+def bump_ranking_generation():
+    """
+    ランキングの世代番号を新しくして、古い世代のキャッシュを使わないようにする
+    :return int: 新しい世代番号
+    """
+    current = cache.get(RANKING_GENERATION_KEY) or 0
+    generation = max(new_ranking_generation(), current + 1)
+    cache.set(RANKING_GENERATION_KEY, generation, None)
+    return generation
+
+
+def page_cache_key(request, query_params=PAGE_CACHE_QUERY_PARAMS):
+    """
+    ページキャッシュのキーを作る。クエリ文字列はビューが使うものだけを含め、
+    それ以外のクエリ文字列を付けたURLでキャッシュが増えないようにする。
+    :param request:
+    :param query_params: キーに含めるクエリ文字列の名前
+    :return str:
+    """
+    query = urlencode([(name, request.GET[name])
+                       for name in sorted(query_params) if name in request.GET])
+    url = '{}{}?{}'.format(request.get_host(), request.path, query)
+    return 'page:{}:{}'.format(get_ranking_generation(),
+                               hashlib.md5(url.encode()).hexdigest())
+
+
+def cache_public_page(view):
+    """
+    ログインしていないユーザーのGETリクエストのレスポンスを、URLとランキングの世代番号をキーにキャッシュする。
+    データを取得して世代番号が新しくなると、次のリクエストで作り直される。
+    """
+    @wraps(view)
+    def wrapped_view(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or \
+                request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+        cache_key = page_cache_key(request)
+        response = cache.get(cache_key)
+        if response is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.cookies:
+                if hasattr(response, 'render') and callable(response.render):
+                    # TemplateResponseは描画が終わってからキャッシュする
+                    response.add_post_render_callback(
+                        lambda r: cache.set(cache_key, r, PAGE_CACHE_TIMEOUT))
+                else:
+                    cache.set(cache_key, response, PAGE_CACHE_TIMEOUT)
+        return response
+    return wrapped_view
@@ -1,12 +1,25 @@
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
 from django.shortcuts import render
 from django.http import HttpResponse
+from django.http import JsonResponse
+from django.utils.cache import patch_cache_control
+from django.utils.functional import cached_property
 from django.views import View
+from django.views.decorators.http import condition
 from django.views.generic import TemplateView
 
-from .models import Category
 from .models import Content
-from .models import Graph
+from .models import Ranking
+from .models import TwitterUser
+from .registry import category_registry
+from .sparkline import sparkline_svg
+from .utils import cache_public_page
 from .utils import paging
+from .utils import quarter_start_datetime
 
 # Create your views here.
 
@@ -20,9 +33,11 @@ DISPLAY_NUMBER = 15
 
 class CategoryIndexView(View):
     def get(self, request, category_id, *args, **kwargs):
-        category = Category.objects.get(id=category_id)
-        all_contents = Content.sort_twitter_rating_by(category)
-        contents_info = paging(request, all_contents, DISPLAY_NUMBER)
+        category = category_registry.get(category_id)
+        all_contents = Ranking.objects.filter(
+            category=category).with_contents()
+        contents_info = paging(request, all_contents, DISPLAY_NUMBER,
+                               rank_field='rank')
         context = {
             'category': category,
             'contents_info': contents_info,
@@ -30,22 +45,150 @@ class CategoryIndexView(View):
         return render(request, 'ranking/category.html.haml', context)
 
 
+class ContentDetail(object):
+    """
+    content_detail.html.hamlに渡す表示用のデータ。
+    必要なデータは最初にまとめて読み込み、テンプレートから何度参照されても計算は一度だけ行う。
+    """
+
+    def __init__(self, content):
+        self.content = content
+
+    @classmethod
+    def load(cls, content_id):
+        content = Content.objects.select_related(
+            'twitteruser', 'ranking').prefetch_related('staff_set').get(
+            pk=content_id)
+        return cls(content)
+
+    @cached_property
+    def twitteruser(self):
+        if self.content.has_tweets():
+            return self.content.twitteruser
+
+    @cached_property
+    def rank(self):
+        return self.content.rank()
+
+    @cached_property
+    def appraise(self):
+        return self.content.appraise()
+
+    @cached_property
+    def popular_tweet(self):
+        if self.twitteruser:
+            return self.twitteruser.popular_tweet()
+
+    @cached_property
+    def performers(self):
+        return [staff for staff in self.content.staff_set.all()
+                if staff.is_cast]
+
+    @cached_property
+    def only_staff(self):
+        return [staff for staff in self.content.staff_set.all()
+                if not staff.is_cast]
+
+
 class ContentDetailView(View):
     def get(self, request, content_id, *args, **kwargs):
-        content = Content.objects.get(pk=content_id)
+        detail = ContentDetail.load(content_id)
         context = {
-            'content': content,
+            'content': detail.content,
+            'detail': detail,
         }
         return render(request, 'ranking/content_detail.html.haml', context)
 
 
+RANK_GRAPH_CACHE_TIMEOUT = 60 * 60 * 24
+RANK_GRAPH_MAX_AGE = 60 * 10
+
+
+def rank_graph_last_modified(request, content_id):
+    """
+    グラフの元になるツイートを保存すると更新されるTwitterUserの更新日を返す
+    """
+    return TwitterUser.objects.filter(content_id=content_id).values_list(
+        'update_date', flat=True).first()
+
+
+def rank_graph_etag(request, content_id):
+    update_date = rank_graph_last_modified(request, content_id)
+    if update_date:
+        return 'rank-graph-{}-{}'.format(content_id, update_date.timestamp())
+
+
+def rank_graph_svg_etag(request, content_id):
+    """
+    SVGは描画方法によって変わるので、ETagにRANK_GRAPH_BACKENDを含める
+    """
+    etag = rank_graph_etag(request, content_id)
+    if etag:
+        return '{}-{}'.format(etag, settings.RANK_GRAPH_BACKEND)
+
+
+def rank_graph_series(content):
+    """
+    グラフに使う今期のツイート日とポイントを返す
+    :return tuple: (開始日, 終了日, TweetSeries)
+    """
+    start = quarter_start_datetime()
+    end = datetime.now(start.tzinfo)
+    return start, end, content.twitteruser.tweet_series(start)
+
+
+def render_rank_graph(content):
+    """
+    settings.RANK_GRAPH_BACKENDで指定された方法でグラフのSVGを作る
+    """
+    if settings.RANK_GRAPH_BACKEND == 'matplotlib':
+        # matplotlibは重いので、使う設定のときだけimportする
+        from .graph import Graph
+        with Graph() as graph:
+            graph.set_rank_graph(content)
+            return graph.plt_to_svg()
+    start, end, series = rank_graph_series(content)
+    return sparkline_svg(series.dates, series.points(), start, end)
+
+
+@condition(etag_func=rank_graph_svg_etag,
+           last_modified_func=rank_graph_last_modified)
 def get_svg(request, content_id):
-    content = Content.objects.get(pk=content_id)
-    graph = Graph()
-    graph.set_rank_graph(content)
-    svg = graph.plt_to_svg()
-    graph.plt_clean()
-    return HttpResponse(svg, content_type='image/svg+xml')
+    """
+    描画したグラフはコンテンツのidとTwitterUserの更新日をキーにキャッシュする。
+    ツイートを保存すると更新日が変わるので、次のリクエストで描画し直される。
+    If-None-MatchがあればIf-Modified-Sinceより優先されるので、描画方法の変更はETagで伝わる。
+    """
+    content = Content.objects.select_related('twitteruser').get(pk=content_id)
+    cache_key = 'rank_graph:{}:{}:{}'.format(
+        settings.RANK_GRAPH_BACKEND, content_id,
+        content.twitteruser.update_date.timestamp())
+    svg = cache.get(cache_key)
+    if svg is None:
+        svg = render_rank_graph(content)
+        cache.set(cache_key, svg, RANK_GRAPH_CACHE_TIMEOUT)
+    response = HttpResponse(svg, content_type='image/svg+xml')
+    patch_cache_control(response, public=True, max_age=RANK_GRAPH_MAX_AGE)
+    return response
+
+
+@condition(etag_func=rank_graph_etag,
+           last_modified_func=rank_graph_last_modified)
+def get_graph_data(request, content_id):
+    """
+    グラフの元データをJSONで返す。datesはUNIX時間(秒)で、pointsと同じ順に並ぶ。
+    """
+    content = Content.objects.select_related('twitteruser').get(pk=content_id)
+    start, end, series = rank_graph_series(content)
+    response = JsonResponse({
+        'content_id': content.id,
+        'start': int(start.timestamp()),
+        'end': int(end.timestamp()),
+        'dates': [int(date.timestamp()) for date in series.dates],
+        'points': series.points().tolist(),
+    })
+    patch_cache_control(response, public=True, max_age=RANK_GRAPH_MAX_AGE)
+    return response
 
 
 def error_404(request, exception):
@@ -55,6 +198,10 @@ def error_404(request, exception):
     return render(request, 'ranking/404.html.haml', contexts, status=404)
 
 
-index = IndexView.as_view()
-category_index = CategoryIndexView.as_view()
-content_detail = ContentDetailView.as_view()
+# 公開ページは読み込みだけなので、ATOMIC_REQUESTSのトランザクションを使わない
+index = transaction.non_atomic_requests(
+    cache_public_page(IndexView.as_view()))
+category_index = transaction.non_atomic_requests(
+    cache_public_page(CategoryIndexView.as_view()))
+content_detail = transaction.non_atomic_requests(
+    cache_public_page(ContentDetailView.as_view()))
@@ -90,4 +90,14 @@ SASS_PROCESSOR_INCLUDE_DIRS = (
 )
 SASS_PROCESSOR_ROOT = os.path.join(BASE_DIR, 'static')
 SASS_PROCESSOR_INCLUDE_FILE_PATTERN = r'^.+\.(sass|scss)$'
-SASS_TEMPLATE_EXTS = ['.html', '.haml']
\ No newline at end of file
+SASS_TEMPLATE_EXTS = ['.html', '.haml']
+
+# スクレイピングで取得したページのキャッシュ
+SCRAPING_CACHE_DIR = os.path.join(BASE_DIR, 'scraping_cache')
+
+# ポイント推移グラフの描画方法
+# 'sparkline': matplotlibを使わない軽量なSVG, 'matplotlib': matplotlibで描画したSVG
+RANK_GRAPH_BACKEND = 'sparkline'
+
+# タイムラインの更新時に、リツイート数・いいね数を取得し直す最近のツイートの日数
+TWEET_ACTIVE_DAYS = 7
@@ -52,6 +52,13 @@ DATABASES = {
 }
 
 
+# CACHE
+
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
+
 # Log
 DJANGO_LOG_LEVEL = DEBUG
 
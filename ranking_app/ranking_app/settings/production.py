@@ -49,6 +49,14 @@ DATABASES = {
 }
 
 
+# CACHE
+
+CACHES = {
+    'default': env.cache(
+        'CACHE_URL', default='filecache://' + os.path.join(BASE_DIR, 'cache')),
+}
+
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -57,7 +65,6 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'ranking.middleware.InitCreateCategoryMiddleware',
 ]
 
 STATICFILES_FINDERS = [